@@ -4,14 +4,25 @@
 # In[16]:
 
 
-import sys
+import argparse
 import os
 import pandas
-from pandas import ExcelWriter
-import matplotlib
-from matplotlib import pyplot as plt
-import statistics
-import math
+from hypergraph_engine import (sort_days, get_tissue_median_frame,
+                               get_pearson_r, get_windows, get_window_correlations, bin_correlations,
+                               stack_tissue_median_frames, group_by_tissue_mask)
+from dynamic_hypergraph import DynamicHypergraph, get_sweep_thresholds, get_sweep_edge_counts
+from hypergraph_io import (get_input_columns, get_input_cytokines, read_median_array, read_group_blocks,
+                           get_median_array_from_blocks)
+from hypergraph_permutation import (PERMUTATION_MODES, get_time_permutation_pvalues,
+                                    get_sample_permutation_pvalues, attach_pvalues, get_significant_hypergraph)
+from hypergraph_bootstrap import get_bootstrap_stability, attach_stability
+from hypergraph_lagged import LaggedHypergraph
+from hypergraph_cache import ResultCache
+from hypergraph_profile import RunReport
+from hypergraph_metrics import get_hypergraph_metrics, write_metrics
+from hypergraph_batch import (EXCEL_PATTERN, IMAGE_PATTERN, EDGE_LIST_PATTERN, METRICS_PATTERN,
+                              read_subject_median_arrays,
+                              read_directory_median_arrays, run_batch)
 
 # Authors: Ashti M. Shah, University of Pittsburgh School of Medicine 
 # Mentors: Dr. Yoram Vodovotz and Dr. Ruben Zamora
@@ -28,93 +39,101 @@ import math
 # (ex. pg/mL, or some other unit) within the specified tissue at the indicated time point.
 
 
-"Import data"
-raw_data = pandas.DataFrame()
-raw_data = pandas.read_csv('A3_A4_Input.csv') #CHANGE INPUT FILE NAME
-cytokines = list(raw_data.columns.values)[2:] #list of all cytokines
-
-"Sort data by tissue type"
-muscle_raw_data = raw_data.loc[raw_data['Tissue'] == 'Muscle']
-skin_raw_data = raw_data.loc[raw_data['Tissue'] == 'Skin']
-plasma_raw_data = raw_data.loc[raw_data['Tissue'] == 'Plasma']
+# The input can be a CSV file or a Parquet / Arrow file (see hypergraph_io.py). It is read in typed chunks
+# that are reduced straight to medians, so the raw table is never held in memory as a whole.
+
+# Importing this file does not read or compute anything: the functions below can be called from other code, and
+# running the file (python VCA_Dynamic_Hypergraphs.py --help) runs the analysis from the command line, see main.
+# matplotlib and the Excel writers are only imported when images or Excel files are requested.
+
+INPUT_FILE = 'A3_A4_Input.csv' #CHANGE INPUT FILE NAME
+EXCEL_FILE = 'Dynamic_Hypergraphs_Grouped_edges_A9_095.xlsx' #CHANGE FILE NAME
+IMAGE_FILES = 'A3A4_%s.png' #CHANGE FILE NAME
+SWEEP_FILE = 'Dynamic_Hypergraphs_Threshold_Sweep.csv' #CHANGE FILE NAME
+# One row per cytokine and tissue of every hyperedge (see DynamicHypergraph.get_edge_list); .parquet, .arrow or
+# .csv, so other tools can query the results without reading spreadsheets
+EDGE_LIST_FILE = 'Dynamic_Hypergraphs_Edge_List.parquet' #CHANGE FILE NAME
+# Hyperedge sizes, node degrees, positive/negative ratios and turnover of every window (see
+# hypergraph_metrics.py), one csv file per metric; '%s' is replaced by the metric
+METRICS_FILES = 'Dynamic_Hypergraphs_%s.csv' #CHANGE FILE NAME
+# Directed cross-tissue hyperedges between each time interval and the one lag intervals later (see
+# hypergraph_lagged.py), as grouped edge tables and as a long edge list
+LAGGED_FILE = 'Dynamic_Hypergraphs_Lagged_edges.xlsx' #CHANGE FILE NAME
+LAGGED_EDGE_LIST_FILE = 'Dynamic_Hypergraphs_Lagged_Edge_List.parquet' #CHANGE FILE NAME
+# Every stage of the run (reading, medians, correlations, grouping, Excel, images) is timed and its memory and
+# item counts are saved to REPORT_FILE as JSON (see hypergraph_profile.py)
+REPORT_FILE = 'Dynamic_Hypergraphs_Run_Report.json' #CHANGE FILE NAME
+# Medians, correlations and images are cached on disk by a hash of the data they come from (see
+# hypergraph_cache.py), so rerunning after a new time point is added only computes the windows that include it
+CACHE_DIRECTORY = '.hypergraph_cache'
+TISSUES = ('Muscle', 'Skin', 'Plasma')
 
 # For our computational analysis, we use the median value of a cytokine at a given time point across all samples
 
 "Function to get median value for each cytokine and time point by tissue"
-def get_median_for_tissue(tissue_data, cytokines):
+def get_median_for_tissue(tissue_data, cytokines, all_times_str=None):
     "tissue_data: a pandas data frame of of all the data from a specific tissue"
     "cytokines: A list of all the cytokines in the data table"
-    results = pandas.DataFrame()
-    all_times_str = ['d0', 'd3','d5','d7','d9','d11','d20','d23','d25','d27','d31']
-    results['Day']= all_times_str
-    for c in cytokines:
-        "cur_df: data frame where the first column is all the time points in a tissue and the second"
-        "column is the cytokine quantification of cytokine, c"
-        cur_df = pandas.DataFrame()
-        cur_df['Time'] = tissue_data['Day']
-        cur_df[c] = tissue_data [c]
-        list_cur_median_cyt = []
-        for day in all_times_str:
-            cur_day = cur_df.loc[cur_df['Time'] == day] #data frame of all samples at unique time point
-                                                        #and cytokine quantification
-            list_cur_median_cyt.append(cur_day[c].median()) #calculate the median for a given time point
-        results[c]=list_cur_median_cyt
-    return results
-
-#Get the median cytokine value across all samples for each cytokine at each time point
-
-MUSCLE = get_median_for_tissue(muscle_raw_data, cytokines)
-SKIN = get_median_for_tissue(skin_raw_data, cytokines)
-PLASMA = get_median_for_tissue(plasma_raw_data, cytokines)
-
-#Get a focused version of the data frame MUSCLE, SKIN, or PLASMA, that includes only three consecutive
-#time points
+    "all_times_str: optional list of time points, ex: ['d0', 'd3', 'd5']; by default every day in tissue_data"
+    if all_times_str is None:
+        all_times_str = sort_days(tissue_data['Day'])
+    # one grouped aggregation over the days for all cytokines at once
+    results = tissue_data.groupby('Day', sort=False, observed=True)[cytokines].median()
+    results = results.reindex(list(all_times_str))
+    results.index.name = 'Day'
+    return results.reset_index()
+
+#Get the median cytokine value across all samples for each cytokine at each time point, in every tissue at once.
+#medians.values is an array indexed as [tissue, day, cytokine]
+
+"Function to read the median values of muscle, skin and plasma from an input file"
+def get_tissue_medians(input_file, tissues=TISSUES, cache=None):
+    "input_file: path to the input file"
+    "tissues: the tissues to read, in order"
+    "cache: optional ResultCache"
+    "Returns (cytokines, one data frame of median values per tissue), ex: cytokines, MUSCLE, SKIN, PLASMA"
+    cytokines = get_input_cytokines(get_input_columns(input_file)) #list of all cytokines
+    medians = read_median_array(input_file, cytokines, tissues, cache=cache)
+    return (cytokines,) + tuple(get_tissue_median_frame(medians, tissue) for tissue in medians.tissues)
+
+#Get a focused version of the data frame MUSCLE, SKIN, or PLASMA, that includes only the time points of one
+#window (three consecutive time points by default)
 
 "Function to get a Pandas DF of relevant data for correlation matrix:"
-"Rows are 3 consecutive time points, columns are cytokine values (pg/mL)"
+"Rows are consecutive time points, columns are cytokine values (pg/mL)"
 def get_rel_data (tissue_data, time):
     "tissue_data: a pandas data frame of of all the data from a specific tissue"
     "time: an array of the strings of time names, ex: ['d0', 'd3', 'd5']"
-    "rel_data: a df containing data for a given tissue for just three consecutive time points"
-    rel_data = tissue_data.loc[tissue_data['Day'] == time[0]]
-    rel_data = rel_data.append(tissue_data.loc[tissue_data['Day'] == time[1]])
-    rel_data = rel_data.append(tissue_data.loc[tissue_data['Day'] == time[2]])
+    "rel_data: a df containing data for a given tissue for just the consecutive time points in time"
+    rel_data = pandas.concat([tissue_data.loc[tissue_data['Day'] == day] for day in time])
     return rel_data
 
-#Get a table of the pearson's correlation coefficient across three time points for each cytokine within a tissue
+#Get a table of the pearson's correlation coefficient across consecutive time points for each cytokine within a tissue
 
-"Function to calculate significant cytokines within a given tissue"
-def get_significant_cytokines (dynamic_data, time, cytokines, tissue_name):
-    "dynamic_data: pandas data frame of cytokines values in one tissue from three consecutive time points"
-    "time: An array of three integers specifying the time points, ex: [0, 3, 5]"
+"Function to turn Pearson's r values (one per cytokine) into a table of the significant cytokines"
+def get_significant_table(r, cytokines, tissue_name):
+    "r: an array with Pearson's r for each cytokine"
     "cytokines: an array of cytokine names"
     "tissue name: a string specifying the name of the tissue, ex: 'Muscle' or 'Skin'"
-    "significant data: a table including the cytokines where |r| > 0.7"
+    "significant data: a table including the cytokines where |r| >= 0.7"
     significant_data = pandas.DataFrame()
-    list_corr_coeff = []
-    for c in cytokines:
-        y_val = dynamic_data[c] #a single cytokine across three time points
-        df = pandas.DataFrame(y_val)
-        df['time'] = time
-        df = df[['time', c]] #df is a data frame with three time points in column 1 and the median cytokine value
-                             #for a given cytokine in at that time in column 2
-        corr_matrix = df.corr(method = 'pearson')
-        r = (corr_matrix.iloc[0,1])
-        "If r > 0.7 and < 0.95, then r = 0.7; if r > 0.95, then r = 0.95"
-        if r>0.7 and r <0.95:
-            r = 0.7
-        elif r >= 0.95:
-            r = 0.95
-        elif r < -0.7 and r > -0.95:
-            r = -0.7
-        elif r <= -0.95:
-            r = -0.95
-        list_corr_coeff.append(r)
     significant_data['Cytokines in %s'%tissue_name] = cytokines
-    significant_data['Pearsons R - %s'%tissue_name] = list_corr_coeff    
-    significant_data = significant_data[abs(significant_data['Pearsons R - %s'%tissue_name]) >= 0.7]
+    "If r >= 0.7 and < 0.95, then r = 0.7; if r >= 0.95, then r = 0.95"
+    significant_data['Pearsons R - %s'%tissue_name] = bin_correlations(r)
+    significant_data = significant_data[significant_data['Pearsons R - %s'%tissue_name].notna()]
     return significant_data
 
+"Function to calculate significant cytokines within a given tissue"
+def get_significant_cytokines (dynamic_data, time, cytokines, tissue_name):
+    "dynamic_data: pandas data frame of cytokines values in one tissue from consecutive time points"
+    "time: An array of integers specifying the time points, ex: [0, 3, 5]"
+    "cytokines: an array of cytokine names"
+    "tissue name: a string specifying the name of the tissue, ex: 'Muscle' or 'Skin'"
+    "significant data: a table including the cytokines where |r| >= 0.7"
+    # one r per cytokine, computed for all cytokines at once
+    r = get_pearson_r(time, dynamic_data[cytokines].to_numpy(dtype=float).T)
+    return get_significant_table(r, cytokines, tissue_name)
+
 "Function to get all Pearsons correlations for a given time interval in all three tissues"
 def get_dynamic_interval_data (Muscle, Skin, Plasma, time_str, time_int, cytokines):
     "Muscle: Muscle_Mouse1; All data from muscle for a specific mouse"
@@ -132,39 +151,39 @@ def get_dynamic_interval_data (Muscle, Skin, Plasma, time_str, time_int, cytokin
     results = pandas.concat([rel_muscle, rel_skin, rel_plasma], axis=1)
     return results
 
+"Function to get the Pearsons correlations of every dynamic time interval in all three tissues at once"
+def get_all_dynamic_interval_data (Muscle, Skin, Plasma, cytokines, window=3):
+    "Muscle, Skin, Plasma: median cytokine values at each time point, as made by get_median_for_tissue"
+    "cytokines: list of cytokines"
+    "window: the number of consecutive time points in each time interval"
+    "Returns a list of (time_str, data frame) pairs, one per time interval, where each data frame matches"
+    "the output of get_dynamic_interval_data"
+    medians = stack_tissue_median_frames([Muscle, Skin, Plasma], ['Muscle', 'Skin', 'Plasma'], cytokines)
+    # r for every (tissue, time interval, cytokine) in one pass
+    all_r = get_window_correlations(medians, window)
+    results = []
+    for n, cur_times_str in enumerate(get_windows(medians.days, window)):
+        tables = [get_significant_table(all_r[t, n], cytokines, tissue) for t, tissue in enumerate(medians.tissues)]
+        results.append((cur_times_str, pandas.concat(tables, axis=1)))
+    return results
+
 # Function to sort cytokines into groups of tissue. For ex: if IL-17A appears in the dictionary key 'muscle'
 # and the dictionary key 'plasma', then we move IL-17A to the dictionary key 'muscle and plasma'
-# This function is written to be used in hypergraph_grouped_edges
+# Each cytokine gets a bitmask of the tissues it appears in and is grouped by that mask, so this works for any
+# number of tissues. This function is written to be used in hypergraph_grouped_edges
 
-def get_hypergraph_combined_edges(dict_nodes_edges):
+def get_hypergraph_combined_edges(dict_nodes_edges, tissues=('muscle', 'skin', 'plasma')):
     "dict_nodes_edges: a dictionary where the keys are nodes and the definitions are a list of cytokines"
-    "found within that node. Only the keys 'muscle', 'skin', and 'plasma' have definitions at the beginning"
-    "of this function. By the end, edges that surround multiple nodes are sorted into the appropriate key"
-    "this new dictionary is returned"
-    for m in dict_nodes_edges['muscle']:
-        if m in dict_nodes_edges['skin'] and m in dict_nodes_edges['plasma']:
-            dict_nodes_edges['muscle, skin, and plasma'].append(m)
-        elif m in dict_nodes_edges['skin']:
-            dict_nodes_edges['muscle and skin'].append(m)
-        elif m in dict_nodes_edges['plasma']:
-            dict_nodes_edges['muscle and plasma'].append(m)     
-    for s in dict_nodes_edges['skin']:
-        if s in dict_nodes_edges['plasma'] and s not in dict_nodes_edges['muscle']:
-            dict_nodes_edges['skin and plasma'].append(s)
-    for msp in dict_nodes_edges['muscle, skin, and plasma']:
-        dict_nodes_edges['muscle'].remove(msp)
-        dict_nodes_edges['skin'].remove(msp)
-        dict_nodes_edges['plasma'].remove(msp)
-    for mp in dict_nodes_edges['muscle and plasma']:
-        dict_nodes_edges['muscle'].remove(mp)
-        dict_nodes_edges['plasma'].remove(mp)
-    for ms in dict_nodes_edges['muscle and skin']:
-        dict_nodes_edges['muscle'].remove(ms)
-        dict_nodes_edges['skin'].remove (ms)
-    for sp in dict_nodes_edges['skin and plasma']:
-        dict_nodes_edges['skin'].remove(sp)
-        dict_nodes_edges['plasma'].remove(sp)
-    return dict_nodes_edges
+    "found within that node. Only the single tissue keys ('muscle', 'skin', and 'plasma' by default) have"
+    "definitions at the beginning of this function. The returned dictionary has a key for every group of"
+    "tissues, ex: 'muscle and skin' or 'muscle, skin, and plasma', and edges that surround multiple nodes are"
+    "sorted into the appropriate key"
+    "tissues: the names of the single tissue keys, in the order used for the group names"
+    membership = {}
+    for bit, tissue in enumerate(tissues):
+        for cytokine in dict_nodes_edges[tissue]:
+            membership[cytokine] = membership.get(cytokine, 0) | (1 << bit)
+    return group_by_tissue_mask(list(membership), list(membership.values()), list(tissues))
 
 # Function to group all of the edges into subsets of nodes (ex. muscle and skin, muscle, and plasma,
 # muscle alone)
@@ -173,249 +192,273 @@ def hypergraphs_grouped_edges(cur_graph):
     "cur_graph: a data frame containing 6 columns organized as --> cytokines in muscle, pearson's r muscle, etc."
     "results: a data frame of cytokines organized by groups of tissues that they appear in as well as "
     "pearson's r"
-    "Create dictionaries to sort cytokines that appear in multiple tissues"
-    edge_neg_095 ={'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[], 'muscle, skin, and plasma':[]}
-    edge_neg_07 = {'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[],'muscle, skin, and plasma':[]}
-    edge_pos_095 = {'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[],'muscle, skin, and plasma':[]}
-    edge_pos_07 = {'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[], 'muscle, skin, and plasma':[]}
-    
-    # iterate through each row of cur_graph     
-    for index, row in cur_graph.iterrows():
-        muscle_sig = row['Pearsons R - Muscle']
-        skin_sig = row ['Pearsons R - Skin']
-        plasma_sig = row['Pearsons R - Plasma']
-        # Dependeing on the value of r, append the cytokine in muscle, skin, or plasma into its
-        # respective dictionary of edges
-        if math.isnan(muscle_sig) == False:
-            if muscle_sig == 0.7:
-                edge_pos_07['muscle'].append(row['Cytokines in Muscle'])
-            elif muscle_sig == 0.95:
-                edge_pos_095['muscle'].append(row['Cytokines in Muscle'])
-            elif muscle_sig == -0.7:
-                edge_neg_07['muscle'].append(row['Cytokines in Muscle'])
-            elif muscle_sig == -0.95:
-                edge_neg_095['muscle'].append(row['Cytokines in Muscle'])
-        if math.isnan(skin_sig) == False:
-            if skin_sig == 0.7:
-                edge_pos_07['skin'].append(row['Cytokines in Skin'])
-            elif skin_sig == 0.95:
-                edge_pos_095['skin'].append(row['Cytokines in Skin'])
-            elif skin_sig == -0.7:
-                edge_neg_07['skin'].append(row['Cytokines in Skin'])
-            elif skin_sig == -0.95:
-                edge_neg_095['skin'].append(row['Cytokines in Skin'])
-        if math.isnan(plasma_sig) == False:
-            if plasma_sig == 0.7:
-                edge_pos_07['plasma'].append(row['Cytokines in Plasma'])
-            elif plasma_sig == 0.95:
-                edge_pos_095['plasma'].append(row['Cytokines in Plasma'])
-            elif plasma_sig == -0.7:
-                edge_neg_07['plasma'].append(row['Cytokines in Plasma'])
-            elif plasma_sig == -0.95:
-                edge_neg_095['plasma'].append(row['Cytokines in Plasma'])
-
-    edge_neg_095_sorted = pandas.DataFrame.from_dict(get_hypergraph_combined_edges(edge_neg_095), orient = 'index')
-    edge_neg_07_sorted = pandas.DataFrame.from_dict(get_hypergraph_combined_edges(edge_neg_07), orient = 'index')
-    edge_pos_095_sorted = pandas.DataFrame.from_dict(get_hypergraph_combined_edges(edge_pos_095), orient = 'index')
-    edge_pos_07_sorted = pandas.DataFrame.from_dict(get_hypergraph_combined_edges(edge_pos_07), orient = 'index')
-    keys = ['Edge = 0.95', 'Edge = 0.7', 'Edge = -0.95', 'Edge = -0.7']
-    results = pandas.concat([edge_pos_095_sorted, edge_pos_07_sorted, edge_neg_095_sorted, edge_neg_07_sorted], axis = 1, keys = keys)   
-    return results
-
-#Function to plot a singular dynamic hypergraph
-def plot_hypergraph(cur_dict, color, figure, grid_spec, panel, title, thickness):
-    "cur_dict: a dictionary where the keys are nodes or groups of nodes and the definitions are edges"
-    "ex: edge_neg_095_sorted"
-    "color: the color of the graph"
-    "figure: the actual figure panel"
-    "grid_spec: to space the graphs"
-    "panel: A, B, C, or D, to specify the location of the subplot on the overall figure"
-    "title: title of the subgraph"
-    "thickness: an integer, indicating the thickness of the lines of the graph"
-    
-    if panel == 'A':
-        ax = figure.add_subplot(grid_spec[0,0])
-    elif panel == 'B':
-        ax = figure.add_subplot(grid_spec[0,1])
-    elif panel == 'C':
-        ax = figure.add_subplot(grid_spec[1,0])
-    else:
-        ax = figure.add_subplot(grid_spec[1,1])
-        
-    plt.title(title, size=36)
-    x_coords_edge = [0.75,6]
-    # coordinates for the location of groups of edges depending on the edge group (ex: muscle and plasma located
-    # at (10, 8.34))
-    muscle_only_y = [10, 10]
-    skin_only_y =[5, 5]
-    plasma_only_y = [0.1, 0.1]
-    muscle_skin_y1 = [10, 6.67]
-    muscle_skin_y2 = [5, 6.67]
-    muscle_plasma_y1 = [10, 8.34]
-    muscle_plasma_y2 = [0.1, 8.34]
-    plasma_skin_y1 = [0.1, 3.34]
-    plasma_skin_y2 = [5, 3.34]
-    msp_y1 = [10, 1.67]
-    msp_y2 = [5, 1.67]
-    msp_y3 = [0.1, 1.67]
-    
-    muscle_label = 'MUSCLE'
-    skin_label = 'SKIN'
-    plasma_label = 'PLASMA'
-    plt.text(-2,10.2, muscle_label, fontsize=36, verticalalignment='top')
-    plt.text(-2,5.2, skin_label, fontsize=36, verticalalignment='top')
-    plt.text(-2,0.2, plasma_label, fontsize=36,verticalalignment='top')
-    if (cur_dict['muscle']) != []:
-        plt.plot(x_coords_edge, muscle_only_y, color, linewidth = thickness)
-        if len(cur_dict['muscle']) > 5:
-            plt.text(6.5, 10.3, "           ".join(cur_dict['muscle'][0:6]),fontsize=24, verticalalignment='top')
-            plt.text(6.5, 10, "           ".join(cur_dict['muscle'][6:]),fontsize=24, verticalalignment='top')
-        else:
-            plt.text(6.5, 10.2, "           ".join(cur_dict['muscle']),fontsize=24, verticalalignment='top')
-    if (cur_dict['skin']) != []:
-        plt.plot(x_coords_edge, skin_only_y, color, linewidth = thickness)
-        if len(cur_dict['skin']) > 5:
-            plt.text(6.5, 5.3, "           ".join(cur_dict['skin'][0:6]),fontsize=24, verticalalignment='top')
-            plt.text(6.5, 4.6, "           ".join(cur_dict['skin'][6:]),fontsize=24, verticalalignment='top')
-        else:
-            plt.text(6.5, 5.2, "           ".join(cur_dict['skin']),fontsize=24, verticalalignment='top')
-    if (cur_dict['plasma']) != []:
-        plt.plot(x_coords_edge, plasma_only_y, color, linewidth = thickness)
-        if len(cur_dict['plasma']) > 5:
-            plt.text(6.5, 0.7, "           ".join(cur_dict['plasma'][0:6]),fontsize=24, verticalalignment='top')
-            plt.text(6.5, 0.1, "           ".join(cur_dict['plasma'][6:]),fontsize=24, verticalalignment='top')
-        else:
-            plt.text(6.5, 0.2, "           ".join(cur_dict['plasma']),fontsize= 24, verticalalignment='top')
-    if (cur_dict['muscle and skin']) != []:
-        plt.plot(x_coords_edge, muscle_skin_y1, color, linewidth = thickness)
-        plt.plot(x_coords_edge, muscle_skin_y2, color, linewidth = thickness)
-        if len(cur_dict['muscle and skin']) > 5:
-            plt.text(6.5, 6.97, "           ".join(cur_dict['muscle and skin'][0:6]),fontsize=24, verticalalignment='top')
-            plt.text(6.5, 6.67, "           ".join(cur_dict['muslce and skin'][6:]),fontsize=24, verticalalignment='top')
-        else:
-            plt.text(6.5, 6.87, "           ".join(cur_dict['muscle and skin']),fontsize=24, verticalalignment='top')
-    if (cur_dict['muscle and plasma']) != []:
-        plt.plot(x_coords_edge, muscle_plasma_y1, color, linewidth = thickness)
-        plt.plot(x_coords_edge, muscle_plasma_y2, color, linewidth = thickness)
-        if len(cur_dict['muscle and plasma']) > 5:
-            plt.text(6.5, 8.64, "           ".join(cur_dict['muscle and plasma'][0:6]),fontsize=24, verticalalignment='top')
-            plt.text(6.5, 8.34, "           ".join(cur_dict['muscle and plasma'][6:]),fontsize=24, verticalalignment='top')
-        else: 
-            plt.text(6.5, 8.54, "           ".join(cur_dict['muscle and plasma']),fontsize=24, verticalalignment='top')
-    if (cur_dict['skin and plasma']) != []:
-        plt.plot(x_coords_edge, plasma_skin_y1, color, linewidth = thickness)
-        plt.plot(x_coords_edge, plasma_skin_y2, color, linewidth = thickness)
-        if len(cur_dict['skin and plasma']) > 5:
-            plt.text(6.5, 3.64, "           ".join(cur_dict['skin and plasma'][0:6]),fontsize=24, verticalalignment='top')
-            plt.text(6.5, 2.90, "           ".join(cur_dict['skin and plasma'][6:]),fontsize=24, verticalalignment='top')
-        else:
-            plt.text(6.5, 3.54, "           ".join(cur_dict['skin and plasma']),fontsize=24, verticalalignment='top')
-    if (cur_dict['muscle, skin, and plasma']) != []:
-        plt.plot(x_coords_edge, msp_y1, color, linewidth = thickness)
-        plt.plot(x_coords_edge, msp_y2, color, linewidth = thickness)
-        plt.plot(x_coords_edge, msp_y3, color, linewidth = thickness)
-        if len(cur_dict['muscle and plasma']) > 5:
-            plt.text(6.5, 1.97, "           ".join(cur_dict['muscle, skin, and plasma'][0:6]),fontsize=24, verticalalignment='top')
-            plt.text(6.5, 1.67, "           ".join(cur_dict['muscle, skin, and plasma'][6:]),fontsize=24, verticalalignment='top')
-        else:
-            plt.text(6.5, 1.77, "           ".join(cur_dict['muscle, skin, and plasma']),fontsize=24, verticalalignment='top')
-        
-
-    plt.xlim(0,10)
-    plt.ylim(-1,12)
-    plt.axis('off')
-    return figure
+    hypergraph = DynamicHypergraph.from_interval_frame(cur_graph)
+    return hypergraph.get_grouped_edges(0)
 
+# Function to draw the hypergraph image of one time interval of a DynamicHypergraph
+def draw_dynamic_hypergraph(hypergraph, n, title):
+    "hypergraph: a DynamicHypergraph"
+    "n: the index of the time interval"
+    "title: title for dynamic hypergraph image"
+    from hypergraph_render import render_hypergraph_figure
+    strongest = hypergraph.levels[0]
+    render_hypergraph_figure(hypergraph.get_edges(n, strongest), hypergraph.get_edges(n, -strongest), strongest,
+                             title, IMAGE_FILES%title)
 
 # Function to generate hypergraph image for a dynamic time interval
 def generate_dynamic_hypergraphs(cur_graph, title):
     "cur_graph: a data frame containing 6 columns organized as --> cytokines in muscle, pearson's r muscle, etc."
     "title: title for dynamic hypergraph image"
-    edge_neg_095 ={'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[], 'muscle, skin, and plasma':[]}
-    edge_neg_07 = {'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[],'muscle, skin, and plasma':[]}
-    edge_pos_095 = {'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[],'muscle, skin, and plasma':[]}
-    edge_pos_07 = {'muscle':[], 'skin':[], 'plasma':[], 'muscle and skin':[], 'muscle and plasma':[], 'skin and plasma':[], 'muscle, skin, and plasma':[]}
-    
-    # iterate through each row of cur_graph     
-    for index, row in cur_graph.iterrows():
-        muscle_sig = row['Pearsons R - Muscle']
-        skin_sig = row ['Pearsons R - Skin']
-        plasma_sig = row['Pearsons R - Plasma']
-        # Dependeing on the value of r, append the cytokine in muscle, skin, or plasma into its
-        # respective dictionary of edges
-        if math.isnan(muscle_sig) == False:
-            if muscle_sig == 0.7:
-                edge_pos_07['muscle'].append(row['Cytokines in Muscle'])
-            elif muscle_sig == 0.95:
-                edge_pos_095['muscle'].append(row['Cytokines in Muscle'])
-            elif muscle_sig == -0.7:
-                edge_neg_07['muscle'].append(row['Cytokines in Muscle'])
-            elif muscle_sig == -0.95:
-                edge_neg_095['muscle'].append(row['Cytokines in Muscle'])
-        if math.isnan(skin_sig) == False:
-            if skin_sig == 0.7:
-                edge_pos_07['skin'].append(row['Cytokines in Skin'])
-            elif skin_sig == 0.95:
-                edge_pos_095['skin'].append(row['Cytokines in Skin'])
-            elif skin_sig == -0.7:
-                edge_neg_07['skin'].append(row['Cytokines in Skin'])
-            elif skin_sig == -0.95:
-                edge_neg_095['skin'].append(row['Cytokines in Skin'])
-        if math.isnan(plasma_sig) == False:
-            if plasma_sig == 0.7:
-                edge_pos_07['plasma'].append(row['Cytokines in Plasma'])
-            elif plasma_sig == 0.95:
-                edge_pos_095['plasma'].append(row['Cytokines in Plasma'])
-            elif plasma_sig == -0.7:
-                edge_neg_07['plasma'].append(row['Cytokines in Plasma'])
-            elif plasma_sig == -0.95:
-                edge_neg_095['plasma'].append(row['Cytokines in Plasma'])
-
-    edge_neg_095_sorted = get_hypergraph_combined_edges(edge_neg_095)
-    edge_neg_07_sorted = get_hypergraph_combined_edges(edge_neg_07)
-    edge_pos_095_sorted = get_hypergraph_combined_edges(edge_pos_095)
-    edge_pos_07_sorted = get_hypergraph_combined_edges(edge_pos_07)
-    
-    fig = plt.figure(figsize=(18, 18))
-    gs = fig.add_gridspec(nrows=2, ncols=1, hspace= 0.5, wspace=1.5)
-    
-    fig = plot_hypergraph(edge_pos_095_sorted, 'k-', fig, gs, 'A', "Pearson's r > +0.95", 8)
-#     fig = plot_hypergraph(edge_pos_07_sorted, 'k-', fig, gs, 'B', "Pearson's r > +0.7", 2)
-    fig = plot_hypergraph(edge_neg_095_sorted, 'r-', fig, gs, 'C', "Pearson's r < - 0.95", 8)
-#     fig = plot_hypergraph(edge_neg_07_sorted, 'r-', fig, gs, 'D', "Pearson's r < -0.7", 2)
-    fig.suptitle(title, size=40)
-    fig.savefig('A3A4_%s.png'%title, bbox_inches="tight") #CHANGE FILE NAME
+    hypergraph = DynamicHypergraph.from_interval_frame(cur_graph)
+    draw_dynamic_hypergraph(hypergraph, 0, title)
 
 #Function to get dynamic hypergraphs, in tabular form, across all dynamic time intervals
 #Saves dynamic hypergraphs to a multi-tab excel file
-def get_all_dynamic_hypergraphs_EXCEL(MUSCLE, SKIN, PLASMA, cytokines):
+def get_all_dynamic_hypergraphs_EXCEL(MUSCLE, SKIN, PLASMA, cytokines, window=3, cache=None, path=EXCEL_FILE):
     "Inputs: median cytokine values at each time point in muscle, skin, and plasma"
     "cytokines: a list of cytokines"
-    all_times_str = ['d0', 'd3','d5','d7','d9','d11','d20','d23','d25','d27','d31']
-    all_times_int = [0, 3, 5, 7, 9, 11, 20, 23, 25, 27, 31]
-    writer = pandas.ExcelWriter('Dynamic_Hypergraphs_Grouped_edges_A9_095.xlsx') #CHANGE FILE NAME
-    for n in range (0,9):
-        cur_times_str = all_times_str[n:n+3]
-        cur_times_int = all_times_int [n:n+3]
-        cur_dynamic_hypergraph = get_dynamic_interval_data(MUSCLE, SKIN, PLASMA, cur_times_str, cur_times_int, cytokines)   
-        cur_dynamic_hypergraph = cur_dynamic_hypergraph.reset_index()
-        cur_dynamic_hypergraph = hypergraphs_grouped_edges(cur_dynamic_hypergraph)
-        cur_dynamic_hypergraph.to_excel(writer, '_'.join(cur_times_str))
-    writer.save()
+    "window: the number of consecutive time points in each time interval"
+    "cache: optional ResultCache; only the time intervals that are not cached are computed"
+    "path: the Excel file to write"
+    medians = stack_tissue_median_frames([MUSCLE, SKIN, PLASMA], ['Muscle', 'Skin', 'Plasma'], cytokines)
+    hypergraph = DynamicHypergraph.from_medians(medians, window, cache=cache)
+    hypergraph.to_excel(path)
     
 #Function to get dynamic hypergraphs, in image form, across all dynamic time intervals
 #Saves dynamic hypergraph images to local folder
-def get_all_dynamic_hypergraphs_IMGS(MUSCLE, SKIN, PLASMA, cytokines):
-    all_times_str = ['d0', 'd3','d5','d7','d9','d11','d20','d23','d25','d27','d31']
-    all_times_int = [0, 3, 5, 7, 9, 11, 20, 23, 25, 27, 31]
-    for n in range (0,9):
-        cur_times_str = all_times_str[n:n+3]
-        cur_times_int = all_times_int [n:n+3]
-        cur_dynamic_hypergraph = get_dynamic_interval_data(MUSCLE, SKIN, PLASMA, cur_times_str, cur_times_int, cytokines)   
-        cur_dynamic_hypergraph = cur_dynamic_hypergraph.reset_index()
-        cur_dynamic_hypergraph = generate_dynamic_hypergraphs(cur_dynamic_hypergraph, ', '.join(cur_times_str))
+def get_all_dynamic_hypergraphs_IMGS(MUSCLE, SKIN, PLASMA, cytokines, window=3, workers=None, cache=None,
+                                     path_pattern=IMAGE_FILES):
+    "Inputs: median cytokine values at each time point in muscle, skin, and plasma"
+    "cytokines: a list of cytokines"
+    "window: the number of consecutive time points in each time interval"
+    "workers: the number of processes drawing images; None uses every core and 1 draws in this process"
+    "cache: optional ResultCache; images whose hyperedges did not change are not drawn again"
+    "path_pattern: the file name of each image, '%s' is replaced by the time points"
+    from hypergraph_render import render_dynamic_hypergraphs
+    medians = stack_tissue_median_frames([MUSCLE, SKIN, PLASMA], ['Muscle', 'Skin', 'Plasma'], cytokines)
+    hypergraph = DynamicHypergraph.from_medians(medians, window, cache=cache)
+    render_dynamic_hypergraphs(hypergraph, path_pattern, workers, cache)
     
-get_all_dynamic_hypergraphs_IMGS(MUSCLE, SKIN, PLASMA, cytokines)
+#Function to get dynamic hypergraphs for a whole list of thresholds from one correlation pass
+#Saves how the hyperedge counts change with the threshold to a csv file
+def get_all_dynamic_hypergraphs_SWEEP(MUSCLE, SKIN, PLASMA, cytokines, thresholds=None, window=3, cache=None,
+                                      excel_pattern=None, path=SWEEP_FILE):
+    "Inputs: median cytokine values at each time point in muscle, skin, and plasma"
+    "cytokines: a list of cytokines"
+    "thresholds: a list of |r| cut-offs; by default 0.5 to 0.99 in steps of 0.05"
+    "window: the number of consecutive time points in each time interval"
+    "cache: optional ResultCache"
+    "excel_pattern: optional file name for the tables of each threshold, '%g' is replaced by the threshold,"
+    "ex: 'Dynamic_Hypergraphs_Grouped_edges_r%g.xlsx'"
+    "path: the csv file with the hyperedge counts of every threshold"
+    "Returns a dictionary from each threshold to its DynamicHypergraph"
+    if thresholds is None:
+        thresholds = get_sweep_thresholds()
+    medians = stack_tissue_median_frames([MUSCLE, SKIN, PLASMA], ['Muscle', 'Skin', 'Plasma'], cytokines)
+    hypergraph = DynamicHypergraph.from_medians(medians, window, cache=cache)
+    sweep = hypergraph.get_threshold_sweep(thresholds)
+    get_sweep_edge_counts(sweep).to_csv(path, index=False)
+    if excel_pattern is not None:
+        for threshold, cur_hypergraph in sweep.items():
+            cur_hypergraph.to_excel(excel_pattern % threshold)
+    return sweep
+
+#Function to get dynamic hypergraphs for many subjects or cohorts at once, in a process pool
+#Saves each subject's Excel file and images plus a combined summary to output_directory
+def get_all_dynamic_hypergraphs_BATCH(input_path, subject_column=None, output_directory='.', window=3,
+                                      tissues=TISSUES, workers=None, cache=None, excel_pattern=EXCEL_PATTERN,
+                                      image_pattern=IMAGE_PATTERN, thresholds=(0.7, 0.95), days=None,
+                                      edge_list_pattern=None, streaming_excel=False, metrics_pattern=None):
+    "input_path: an input file with a column identifying the subject of each sample, or a directory with one"
+    "input file per subject"
+    "subject_column: the column identifying the subject, ex: 'Animal'; not used for a directory"
+    "output_directory: the folder the files are written to"
+    "window: the number of consecutive time points in each time interval"
+    "tissues: the tissues of the hypergraphs, in the order used for the images"
+    "workers: the number of processes; None uses every core"
+    "cache: optional ResultCache"
+    "excel_pattern, image_pattern: the output file names, {subject} and {window} are filled in; None skips them"
+    "thresholds: the edge strengths, see bin_correlations"
+    "days: optional list of the time points to use; by default every time point of each subject"
+    "edge_list_pattern: optional file name of each subject's edge list, ex: EDGE_LIST_PATTERN"
+    "streaming_excel: write the Excel files row by row, see DynamicHypergraph.to_excel"
+    "metrics_pattern: optional file name of each subject's metrics, ex: METRICS_PATTERN"
+    if os.path.isdir(input_path):
+        medians_by_subject = read_directory_median_arrays(input_path, tissues=tissues, days=days, cache=cache)
+    else:
+        medians_by_subject = read_subject_median_arrays(input_path, subject_column, tissues=tissues, days=days,
+                                                        cache=cache)
+    return run_batch(medians_by_subject, output_directory, window, thresholds, excel_pattern, image_pattern,
+                     workers, cache, edge_list_pattern=edge_list_pattern, streaming_excel=streaming_excel,
+                     metrics_pattern=metrics_pattern)
+
+#Function to get the dynamic hypergraphs of one input file and save the requested outputs
+def run_dynamic_hypergraphs(input_file=INPUT_FILE, output_directory='.', tissues=TISSUES, days=None, window=3,
+                            thresholds=(0.7, 0.95), excel_file=EXCEL_FILE, image_pattern=IMAGE_FILES,
+                            sweep_file=None, sweep_thresholds=None, workers=None, cache=None, edge_list_file=None,
+                            streaming_excel=False, metrics_files=None, permutations=0, permutation_mode='samples',
+                            seed=0, alpha=None, bootstrap=0, lag=1, lagged_file=None, lagged_edge_list_file=None):
+    "input_file: path to the input file"
+    "output_directory: the folder the files are written to; it is created when missing"
+    "tissues: the tissues to use, in the order of the group names; None uses every tissue of the input. The"
+    "images need muscle, skin and plasma, in any order"
+    "days: optional list of the time points to use; by default every time point of the input"
+    "window: the number of consecutive time points in each time interval"
+    "thresholds: the edge strengths, see bin_correlations"
+    "excel_file, image_pattern, sweep_file: the output file names, see EXCEL_FILE, IMAGE_FILES and SWEEP_FILE;"
+    "None skips the output"
+    "sweep_thresholds: the |r| cut-offs of the sweep; by default 0.5 to 0.99 in steps of 0.05"
+    "workers: the number of processes drawing images, testing permutations and resampling; None uses every core"
+    "cache: optional ResultCache"
+    "edge_list_file: optional file name of the long edge list, see EDGE_LIST_FILE"
+    "streaming_excel: write the Excel file row by row, see DynamicHypergraph.to_excel"
+    "metrics_files: optional file name of each metric, see METRICS_FILES"
+    "permutations: the number of permutations testing each r (see hypergraph_permutation.py); 0 skips the test."
+    "The p-values and false discovery rates are added to the edge list"
+    "permutation_mode: 'samples' shuffles the raw samples between the days of a window, 'time' the time points"
+    "seed: seed of the permutations"
+    "alpha: optional false discovery rate; only the hyperedges with q <= alpha are kept in every output"
+    "bootstrap: the number of bootstrap replicates measuring how often each hyperedge appears when the raw"
+    "samples are resampled (see hypergraph_bootstrap.py); 0 skips it. The shares are added to the edge list."
+    "They refer to the hyperedges before alpha, since the replicates are not tested: a hyperedge that alpha"
+    "shrank keeps the stability of its full tissue set"
+    "lag: the number of time intervals between the source and the target of the lagged cross-tissue hyperedges"
+    "lagged_file, lagged_edge_list_file: optional file names of the lagged hyperedges, see LAGGED_FILE and"
+    "LAGGED_EDGE_LIST_FILE"
+    "Returns the DynamicHypergraph"
+    os.makedirs(output_directory, exist_ok=True)
+    cytokines = get_input_cytokines(get_input_columns(input_file))
+    blocks = read_group_blocks(input_file, ['Tissue', 'Day'], cytokines)
+    medians = get_median_array_from_blocks(blocks, cytokines, tissues, days, cache)
+    hypergraph = DynamicHypergraph.from_medians(medians, window, thresholds, cache)
+    if permutations:
+        if permutation_mode == 'samples':
+            p = get_sample_permutation_pvalues(blocks, medians, window, permutations, seed, workers=workers)
+        else:
+            p = get_time_permutation_pvalues(medians, window, permutations, seed, workers=workers)
+        attach_pvalues(hypergraph, p)
+    # the replicates are not tested for significance, so they are compared with the hyperedges before alpha
+    if bootstrap:
+        attach_stability(hypergraph, get_bootstrap_stability(blocks, medians, hypergraph, window, bootstrap, seed,
+                                                             workers=workers))
+    if permutations and alpha is not None:
+        hypergraph = get_significant_hypergraph(hypergraph, alpha)
+    if excel_file is not None:
+        hypergraph.to_excel(os.path.join(output_directory, excel_file), streaming_excel)
+    if edge_list_file is not None:
+        hypergraph.to_edge_list(os.path.join(output_directory, edge_list_file))
+    if metrics_files is not None:
+        write_metrics(get_hypergraph_metrics(hypergraph), os.path.join(output_directory, metrics_files))
+    if image_pattern is not None:
+        from hypergraph_render import render_dynamic_hypergraphs
+        render_dynamic_hypergraphs(hypergraph, os.path.join(output_directory, image_pattern), workers, cache)
+    if sweep_file is not None:
+        sweep = hypergraph.get_threshold_sweep(sweep_thresholds or get_sweep_thresholds())
+        get_sweep_edge_counts(sweep).to_csv(os.path.join(output_directory, sweep_file), index=False)
+    if lagged_file is not None or lagged_edge_list_file is not None:
+        lagged = LaggedHypergraph.from_medians(medians, window, lag, thresholds)
+        if lagged_file is not None:
+            lagged.to_excel(os.path.join(output_directory, lagged_file))
+        if lagged_edge_list_file is not None:
+            lagged.to_edge_list(os.path.join(output_directory, lagged_edge_list_file))
+    return hypergraph
+
+# Command line. With no output option the images are drawn, as this script always did, ex:
+#     python VCA_Dynamic_Hypergraphs.py A3_A4_Input.csv --excel --images --window 3 --thresholds 0.7 0.95
+#     python VCA_Dynamic_Hypergraphs.py cohort.csv --subject-column Animal --excel --output-directory results
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Make dynamic hypergraphs of inflammatory mediators')
+    parser.add_argument('input', nargs='?', default=INPUT_FILE,
+                        help='input file (CSV, Parquet or Arrow), or a directory with one input file per subject')
+    parser.add_argument('--output-directory', default='.', help='folder the outputs are written to')
+    parser.add_argument('--tissues', nargs='+', default=list(TISSUES),
+                        help='tissues to use, in order, ignoring case; the images need Muscle, Skin and Plasma')
+    parser.add_argument('--days', nargs='+', help='time points to use, ignoring case, by default all of them')
+    parser.add_argument('--window', type=int, default=3, help='consecutive time points in each time interval')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.7, 0.95], help='edge strengths')
+    parser.add_argument('--excel', nargs='?', const=EXCEL_FILE, help='write the grouped edges to an Excel file')
+    parser.add_argument('--streaming-excel', action='store_true',
+                        help='write the Excel file row by row to keep memory constant')
+    parser.add_argument('--edge-list', nargs='?', const=EDGE_LIST_FILE,
+                        help='write one row per hyperedge cytokine and tissue to a Parquet, Arrow or csv file')
+    parser.add_argument('--metrics', nargs='?', const=METRICS_FILES,
+                        help="write hyperedge sizes, node degrees, sign ratios and turnover, '%%s' is the metric")
+    parser.add_argument('--images', nargs='?', const=IMAGE_FILES,
+                        help="draw one image per time interval, '%%s' is replaced by the time points")
+    parser.add_argument('--sweep', nargs='?', const=SWEEP_FILE,
+                        help='write the hyperedge counts of a threshold sweep to a csv file')
+    parser.add_argument('--sweep-thresholds', type=float, nargs='+', help='|r| cut-offs of the sweep')
+    parser.add_argument('--permutations', type=int, default=0,
+                        help='permutations testing each correlation; p and q are added to the edge list')
+    parser.add_argument('--permute', choices=PERMUTATION_MODES,
+                        help='shuffle the raw samples between days (default) or the time points of each window')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='bootstrap replicates measuring the stability of each hyperedge, added to the edge list')
+    parser.add_argument('--seed', type=int, help='seed of the permutations and the bootstrap, by default 0')
+    parser.add_argument('--alpha', type=float, help='keep only hyperedges with a false discovery rate <= alpha')
+    parser.add_argument('--lagged', nargs='?', const=LAGGED_FILE,
+                        help='write directed cross-tissue hyperedges between lagged time intervals to an Excel file,'
+                             ' one row per hyperedge')
+    parser.add_argument('--lagged-edge-list', nargs='?', const=LAGGED_EDGE_LIST_FILE,
+                        help='write the lagged cross-tissue correlations to a Parquet, Arrow or csv file')
+    parser.add_argument('--lag', type=int, default=1, help='time intervals between source and target')
+    parser.add_argument('--subject-column', help='column identifying the subject of each sample (batch mode)')
+    parser.add_argument('--workers', type=int, help='number of processes, by default every core')
+    parser.add_argument('--cache-directory', default=CACHE_DIRECTORY, help='folder of the result cache')
+    parser.add_argument('--no-cache', action='store_true', help='compute everything from scratch')
+    parser.add_argument('--report', default=REPORT_FILE, help='JSON run report, written to the output folder')
+    parser.add_argument('--no-report', action='store_true', help='skip the run report')
+    parser.add_argument('--profile-directory', help='folder for one cProfile file per stage')
+    args = parser.parse_args(argv)
+    if args.alpha is not None and not args.permutations:
+        parser.error('--alpha needs --permutations')
+    outputs = (args.excel, args.images, args.sweep, args.edge_list, args.metrics, args.lagged, args.lagged_edge_list)
+    if all(output is None for output in outputs):
+        args.images = IMAGE_FILES
+    if args.images is not None and not {t.lower() for t in TISSUES} <= {t.lower() for t in args.tissues}:
+        parser.error('the images need the tissues %s' % ', '.join(TISSUES))
+    batch = args.subject_column is not None or os.path.isdir(args.input)
+    # options only the run of a single input supports
+    single = [('--sweep', args.sweep), ('--sweep-thresholds', args.sweep_thresholds), ('--permute', args.permute),
+              ('--seed', args.seed), ('--alpha', args.alpha), ('--lagged', args.lagged),
+              ('--lagged-edge-list', args.lagged_edge_list)]
+    # the counts default to 0 rather than None
+    counts = [('--permutations', args.permutations), ('--bootstrap', args.bootstrap)]
+    unsupported = ([name for name, value in single if value is not None]
+                   + [name for name, value in counts if value])
+    if batch and unsupported:
+        parser.error('%s cannot be used in batch mode' % ', '.join(unsupported))
+    if args.permute is None:
+        args.permute = 'samples'
+    if args.seed is None:
+        args.seed = 0
+    cache = None if args.no_cache else ResultCache(args.cache_directory)
+    with RunReport(args.profile_directory, input=args.input) as report:
+        if batch:
+            get_all_dynamic_hypergraphs_BATCH(args.input, args.subject_column, args.output_directory, args.window,
+                                              args.tissues, args.workers, cache,
+                                              EXCEL_PATTERN if args.excel is not None else None,
+                                              IMAGE_PATTERN if args.images is not None else None,
+                                              args.thresholds, args.days,
+                                              EDGE_LIST_PATTERN if args.edge_list is not None else None,
+                                              args.streaming_excel,
+                                              METRICS_PATTERN if args.metrics is not None else None)
+        else:
+            run_dynamic_hypergraphs(args.input, args.output_directory, args.tissues, args.days, args.window,
+                                    args.thresholds, args.excel, args.images, args.sweep, args.sweep_thresholds,
+                                    args.workers, cache, args.edge_list, args.streaming_excel, args.metrics,
+                                    args.permutations, args.permute, args.seed, args.alpha, args.bootstrap,
+                                    args.lag, args.lagged, args.lagged_edge_list)
+    if cache is not None:
+        report.info.update(cache_hits=cache.hits, cache_misses=cache.misses)
+    if not args.no_report:
+        os.makedirs(args.output_directory, exist_ok=True)
+        report.write_json(os.path.join(args.output_directory, args.report))
+
+# The images are drawn in a process pool, so this only runs when the file is executed as a script and not
+# again when a worker process imports it
+if __name__ == '__main__':
+    main()
 
 
 
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy
+import pandas
+from hypergraph_engine import (get_windows, get_window_correlations, bin_correlations, get_membership_masks,
+                               group_by_tissue_mask, get_tissue_mask_name)
+from hypergraph_io import write_table, write_excel_rows
+from hypergraph_cache import get_cached_window_correlations
+from hypergraph_profile import stage, get_active_report
+
+# A DynamicHypergraph holds every hyperedge of every dynamic time interval of a run. It is built once from the
+# median values and then read by the Excel tables, the images and the metrics.
+#
+# The hyperedges are stored as a bit-packed incidence array, masks, of shape (windows, levels, cytokines):
+# masks[w, l, c] is the bitmask of the tissues (bit t for tissues[t]) in which cytokine c has an edge of
+# strength levels[l] during window w, and 0 when it has none. levels are the signed edge strengths, ordered as
+# in the grouped edge tables: strongest positive first, then the negative strengths, ex: [0.95, 0.7, -0.95, -0.7]
+
+# characters of an Excel sheet name
+EXCEL_MAX_SHEET_NAME = 31
+
+
+"Function to order signed edge strengths like the grouped edge tables, ex: (0.7, 0.95) -> [0.95, 0.7, -0.95, -0.7]"
+def get_edge_levels(thresholds):
+    "thresholds: the edge strengths, ex: (0.7, 0.95)"
+    strengths = sorted(set(thresholds), reverse=True)
+    return strengths + [-s for s in strengths]
+
+
+"Function to name an Excel sheet after one or more windows within the 31 characters Excel allows, ex:"
+"'d0_d3_d5', or 'd0_d31' when every time point does not fit"
+def get_sheet_name(*windows):
+    "windows: the time points of each window, ex: ['d0', 'd3', 'd5']; several windows are joined with ' to '"
+    name = ' to '.join('_'.join(w) for w in windows)
+    if len(name) > EXCEL_MAX_SHEET_NAME:
+        # consecutive windows start on different time points, so the first and last ones keep the names unique
+        name = ' to '.join('%s_%s' % (w[0], w[-1]) for w in windows)
+    return name[:EXCEL_MAX_SHEET_NAME]
+
+
+class DynamicHypergraph:
+    "Hyperedges of all dynamic time intervals, stored as a bit-packed tissue incidence array"
+
+    def __init__(self, tissues, cytokines, windows, levels, masks, r=None):
+        "tissues: a list of tissue names, tissues[t] is bit t of the masks, ex: ['Muscle', 'Skin', 'Plasma']"
+        "cytokines: a list of cytokine names"
+        "windows: a list with the time points of each window, ex: [['d0', 'd3', 'd5'], ['d3', 'd5', 'd7']]"
+        "levels: the signed edge strengths, ex: [0.95, 0.7, -0.95, -0.7]"
+        "masks: an integer array of shape (windows, levels, cytokines), see the top of this file"
+        "r: optional array of the unbinned Pearson's r, shape (tissues, windows, cytokines)"
+        "The p-values of r and their false discovery rates (q) can be added with hypergraph_permutation.py, and"
+        "the bootstrap stability of the hyperedges with hypergraph_bootstrap.py"
+        self.tissues = list(tissues)
+        self.cytokines = list(cytokines)
+        self.windows = [list(w) for w in windows]
+        self.levels = list(levels)
+        self.masks = masks
+        self.r = r
+        self.p = None
+        self.q = None
+        self.stability = None
+
+    @classmethod
+    def from_binned(cls, binned, tissues, cytokines, windows, levels):
+        "binned: an array of shape (tissues, windows, cytokines) of r snapped onto the levels, NaN for no edge"
+        "tissues, cytokines, windows, levels: see __init__"
+        binned = numpy.asarray(binned, dtype=numpy.float64)
+        dtype = numpy.min_scalar_type((1 << len(tissues)) - 1)
+        # membership has shape (tissues, windows, levels, cytokines) and is packed over the tissue axis
+        membership = binned[:, :, None, :] == numpy.asarray(levels, dtype=numpy.float64)[None, None, :, None]
+        masks = get_membership_masks(membership).astype(dtype)
+        return cls(tissues, cytokines, windows, levels, masks)
+
+    @classmethod
+    def from_correlations(cls, r, tissues, cytokines, windows, thresholds=(0.7, 0.95)):
+        "r: an array of Pearson's r of shape (tissues, windows, cytokines), see get_window_correlations"
+        "thresholds: the edge strengths, see bin_correlations"
+        with stage('grouping', tissues=len(tissues), windows=len(windows), cytokines=len(cytokines)) as counts:
+            hypergraph = cls.from_binned(bin_correlations(r, thresholds), tissues, cytokines, windows,
+                                         get_edge_levels(thresholds))
+            hypergraph.r = r
+            if get_active_report() is not None:
+                counts['hyperedges'] = numpy.count_nonzero(hypergraph.masks)
+        return hypergraph
+
+    @classmethod
+    def from_medians(cls, medians, window=3, thresholds=(0.7, 0.95), cache=None):
+        "medians: a MedianArray"
+        "window: the number of consecutive time points in each window"
+        "thresholds: the edge strengths, see bin_correlations"
+        "cache: optional ResultCache; only the windows whose medians are not cached are computed"
+        windows = get_windows(medians.days, window)
+        with stage('correlations', tissues=len(medians.tissues), windows=len(windows),
+                   cytokines=len(medians.cytokines)):
+            if cache is None:
+                r = get_window_correlations(medians, window)
+            else:
+                r = get_cached_window_correlations(medians, window, cache)
+        return cls.from_correlations(r, medians.tissues, medians.cytokines, windows, thresholds)
+
+    @classmethod
+    def from_interval_frame(cls, cur_graph, tissues=('Muscle', 'Skin', 'Plasma'), thresholds=(0.7, 0.95)):
+        "cur_graph: a data frame for one time interval, as made by get_dynamic_interval_data, with the columns"
+        "'Cytokines in <tissue>' and 'Pearsons R - <tissue>' for each tissue"
+        "tissues: the tissue names used in the column names"
+        "thresholds: the edge strengths the r values were snapped onto"
+        names = cur_graph[['Cytokines in %s' % t for t in tissues]].bfill(axis=1).iloc[:, 0]
+        names = names[names.notna()]
+        binned = cur_graph.loc[names.index, ['Pearsons R - %s' % t for t in tissues]].to_numpy(dtype=numpy.float64)
+        return cls.from_binned(binned.T[:, None, :], tissues, list(names), [[]], get_edge_levels(thresholds))
+
+    def get_threshold_sweep(self, thresholds):
+        "thresholds: a list of |r| cut-offs; see get_threshold_sweep, this reuses the raw r of this hypergraph"
+        if self.r is None:
+            raise ValueError("This DynamicHypergraph was built without its raw r values")
+        return get_threshold_sweep(self.r, self.tissues, self.cytokines, self.windows, thresholds)
+
+    def get_reordered(self, tissues):
+        "tissues: every tissue of this hypergraph in a new order"
+        "Returns a DynamicHypergraph with the same hyperedges where tissues[t] is bit t of the masks, so the group"
+        "names follow the new order, ex: 'muscle and skin' instead of 'skin and muscle'"
+        order = [self.tissues.index(tissue) for tissue in tissues]
+        if sorted(order) != list(range(len(self.tissues))):
+            raise ValueError("Expected an order of the tissues %s, got %s" % (self.tissues, list(tissues)))
+        masks = self.masks.astype(numpy.int64)
+        # bit order[t] of the old masks becomes bit t
+        reordered = sum(((masks >> old) & 1) << new for new, old in enumerate(order))
+        return DynamicHypergraph(tissues, self.cytokines, self.windows, self.levels,
+                                 reordered.astype(self.masks.dtype),
+                                 None if self.r is None else numpy.asarray(self.r)[order])
+
+    def get_window_name(self, n):
+        "n: the index of a window; returns its name, ex: 'd0_d3_d5'"
+        return '_'.join(self.windows[n])
+
+    def get_sheet_name(self, n):
+        "n: the index of a window; returns the name of its Excel sheet, see get_sheet_name"
+        return get_sheet_name(self.windows[n])
+
+    def get_edges(self, n, level, include_empty=True):
+        "n: the index of a window"
+        "level: one of self.levels, ex: -0.95"
+        "include_empty: see group_by_tissue_mask"
+        "Returns a dictionary from each group of tissues, ex: 'muscle and skin', to a list of cytokines"
+        masks = self.masks[n, self.levels.index(level)]
+        present = numpy.flatnonzero(masks)
+        # list cytokines in the row order of get_dynamic_interval_data: the cytokines with an edge in the first
+        # tissue come first, then those first found in the second tissue, and so on
+        any_level = numpy.bitwise_or.reduce(self.masks[n], axis=0)[present]
+        first_tissue = any_level & (~any_level + 1)
+        present = present[numpy.argsort(first_tissue, kind='stable')]
+        return group_by_tissue_mask([self.cytokines[c] for c in present], masks[present],
+                                    [t.lower() for t in self.tissues], include_empty)
+
+    def get_grouped_edges(self, n):
+        "n: the index of a window"
+        "Returns a data frame of cytokines organized by groups of tissues that they appear in, with one block"
+        "of columns per edge strength, ex: 'Edge = 0.95'"
+        frames = [pandas.DataFrame.from_dict(self.get_edges(n, level), orient='index') for level in self.levels]
+        if all(frame.shape[1] == 0 for frame in frames):
+            # no edge at any strength: only the groups of tissues, like the rows of get_grouped_edge_rows
+            return frames[0]
+        keys = ['Edge = %g' % level for level in self.levels]
+        return pandas.concat(frames, axis=1, keys=keys)
+
+    def get_edge_counts(self):
+        "Returns a data frame with one row per window and edge strength: the number of cytokines with an edge"
+        "(each one is a hyperedge joining its tissues, as in hypergraph_metrics.py), the number of tissue groups"
+        "holding at least one of them (the rows of the grouped edge tables) and how many of those groups span more"
+        "than one tissue"
+        n_windows, n_levels, n_cytokines = self.masks.shape
+        masks = self.masks.reshape(n_windows * n_levels, n_cytokines).astype(numpy.int64)
+        rows, columns = numpy.nonzero(masks)
+        # each distinct (window and strength, tissue mask) pair is one tissue group
+        shift = len(self.tissues)
+        pairs = numpy.unique((rows.astype(numpy.int64) << shift) | masks[rows, columns])
+        pair_rows = pairs >> shift
+        pair_masks = pairs & ((1 << shift) - 1)
+        multi_tissue = (pair_masks & (pair_masks - 1)) != 0
+        return pandas.DataFrame({
+            'Window': numpy.repeat([self.get_window_name(n) for n in range(n_windows)], n_levels),
+            'Edge': numpy.tile(self.levels, n_windows),
+            'Cytokines': numpy.count_nonzero(masks, axis=1),
+            'Tissue groups': numpy.bincount(pair_rows, minlength=n_windows * n_levels),
+            'Multi-tissue groups': numpy.bincount(pair_rows[multi_tissue], minlength=n_windows * n_levels),
+        })
+
+    def get_grouped_edge_rows(self, n):
+        "n: the index of a window"
+        "Yields the rows of the Excel sheet of get_grouped_edges one at a time, as lists of cell values, without"
+        "building the data frame: the two header rows, the empty row of the index name, then one row per group"
+        "of tissues"
+        edges = [self.get_edges(n, level) for level in self.levels]
+        widths = [max([len(cur) for cur in cur_edges.values()] + [0]) for cur_edges in edges]
+        header = [None]
+        numbers = [None]
+        for level, width in zip(self.levels, widths):
+            if width:
+                header += ['Edge = %g' % level] + [None] * (width - 1)
+                numbers += list(range(width))
+        yield header
+        yield numbers
+        yield []
+        for name in edges[0]:
+            row = [name]
+            for cur_edges, width in zip(edges, widths):
+                row += cur_edges[name] + [None] * (width - len(cur_edges[name]))
+            yield row
+
+    def to_excel(self, path, streaming=False):
+        "path: the Excel file to write; each window is saved to its own sheet, see get_grouped_edges and"
+        "get_sheet_name"
+        "streaming: when True the rows are written one at a time (see write_excel_rows) instead of through a data"
+        "frame per window, so memory stays constant for big panels; the header cells are not merged"
+        with stage('excel', sheets=len(self.windows), cytokines=len(self.cytokines), streaming=streaming):
+            if streaming:
+                write_excel_rows(path, ((self.get_sheet_name(n), self.get_grouped_edge_rows(n))
+                                        for n in range(len(self.windows))))
+            else:
+                with pandas.ExcelWriter(path) as writer:
+                    for n in range(len(self.windows)):
+                        self.get_grouped_edges(n).to_excel(writer, sheet_name=self.get_sheet_name(n))
+        return path
+
+    def get_edge_list(self):
+        "Returns a long data frame with one row per tissue of each cytokine of each hyperedge, in order of window,"
+        "edge strength and cytokine, with the columns Window, Sign ('positive' or 'negative'), Strength (|edge|),"
+        "Tissue set (ex: 'muscle and skin'), Tissue, Cytokine and r (the unbinned Pearson's r of the cytokine in"
+        "that tissue, NaN when this hypergraph was built without it), plus p and q when p-values are attached and"
+        "'Tissue stability' and 'Hyperedge stability' when the bootstrap stability is attached"
+        "The text columns are categoricals, so the table stays small and writes fast to Parquet"
+        masks = self.masks.astype(numpy.int64)
+        windows, levels, cytokines = numpy.nonzero(masks)
+        edge_masks = masks[windows, levels, cytokines]
+        # expand each (window, strength, cytokine) into one row per tissue of its mask
+        edges, tissues = numpy.nonzero((edge_masks[:, None] >> numpy.arange(len(self.tissues))) & 1)
+        windows, levels, cytokines, edge_masks = windows[edges], levels[edges], cytokines[edges], edge_masks[edges]
+        set_masks, set_codes = numpy.unique(edge_masks, return_inverse=True)
+        set_names = [get_tissue_mask_name(int(mask), [t.lower() for t in self.tissues]) for mask in set_masks]
+        signed = numpy.asarray(self.levels, dtype=numpy.float64)[levels]
+        if self.r is None:
+            r = numpy.full(len(edges), numpy.nan)
+        else:
+            r = numpy.asarray(self.r, dtype=numpy.float64)[tissues, windows, cytokines]
+        window_names = [self.get_window_name(n) for n in range(len(self.windows))]
+        results = pandas.DataFrame({
+            'Window': pandas.Categorical.from_codes(windows, window_names),
+            'Sign': pandas.Categorical.from_codes((signed < 0).astype(numpy.int8), ['positive', 'negative']),
+            'Strength': numpy.abs(signed),
+            'Tissue set': pandas.Categorical.from_codes(set_codes.reshape(-1), set_names),
+            'Tissue': pandas.Categorical.from_codes(tissues, self.tissues),
+            'Cytokine': pandas.Categorical.from_codes(cytokines, self.cytokines),
+            'r': r,
+        })
+        for name, values in (('p', self.p), ('q', self.q)):
+            if values is not None:
+                results[name] = numpy.asarray(values, dtype=numpy.float64)[tissues, windows, cytokines]
+        if self.stability is not None:
+            results['Tissue stability'] = self.stability.tissue[tissues, windows, levels, cytokines]
+            results['Hyperedge stability'] = self.stability.hyperedge[windows, levels, cytokines]
+        return results
+
+    def to_edge_list(self, path):
+        "path: the file to write, CSV, Parquet or Arrow by its extension; see get_edge_list and write_table"
+        with stage('edge list', windows=len(self.windows), cytokines=len(self.cytokines)) as counts:
+            edge_list = self.get_edge_list()
+            counts['rows'] = len(edge_list)
+            write_table(edge_list, path)
+        return path
+
+
+# Threshold sweep: instead of snapping r onto fixed strengths, the raw r of one correlation pass is compared
+# against a list of thresholds. |r| is located among the sorted thresholds once; a cytokine then has an edge at
+# threshold i exactly when |r| reached more than i thresholds, so no threshold needs a new correlation pass.
+
+"Function to list evenly spaced thresholds for a sweep, ex: (0.5, 0.99, 0.05) -> [0.5, 0.55, ..., 0.95, 0.99]"
+def get_sweep_thresholds(start=0.5, stop=0.99, step=0.05):
+    "start, stop: the smallest and largest threshold, both included"
+    "step: the spacing of the thresholds"
+    thresholds = numpy.round(numpy.arange(start, stop, step), 6).tolist()
+    if not thresholds or thresholds[-1] < stop:
+        thresholds.append(stop)
+    return thresholds
+
+
+"Function to get one DynamicHypergraph per threshold from the raw r of a single correlation pass"
+def get_threshold_sweep(r, tissues, cytokines, windows, thresholds):
+    "r: an array of Pearson's r of shape (tissues, windows, cytokines), see get_window_correlations"
+    "tissues, cytokines, windows: see DynamicHypergraph"
+    "thresholds: a list of |r| cut-offs, ex: get_sweep_thresholds()"
+    "Returns a dictionary from each threshold, in increasing order, to a DynamicHypergraph with the two levels"
+    "+threshold (r >= threshold) and -threshold (r <= -threshold)"
+    thresholds = sorted(set(float(t) for t in thresholds))
+    r = numpy.asarray(r, dtype=numpy.float64)
+    # reached[t, w, c] is the number of thresholds |r| reaches; NaN reaches none
+    reached = numpy.searchsorted(thresholds, numpy.nan_to_num(numpy.abs(r), nan=-1.0), side='right')
+    positive = r > 0
+    negative = r < 0
+    dtype = numpy.min_scalar_type((1 << len(tissues)) - 1)
+    results = {}
+    for i, threshold in enumerate(thresholds):
+        edge = reached > i
+        # membership has shape (tissues, windows, levels, cytokines), as in DynamicHypergraph.from_binned
+        membership = numpy.stack([edge & positive, edge & negative], axis=2)
+        masks = get_membership_masks(membership).astype(dtype)
+        results[threshold] = DynamicHypergraph(tissues, cytokines, windows, [threshold, -threshold], masks, r)
+    return results
+
+
+"Function to report how the hyperedge counts change with the threshold"
+def get_sweep_edge_counts(sweep):
+    "sweep: a dictionary from threshold to DynamicHypergraph, see get_threshold_sweep"
+    "Returns the edge counts (see DynamicHypergraph.get_edge_counts) of every threshold in one data frame"
+    frames = []
+    for threshold, hypergraph in sweep.items():
+        counts = hypergraph.get_edge_counts()
+        counts.insert(0, 'Threshold', threshold)
+        frames.append(counts)
+    return pandas.concat(frames, ignore_index=True)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas
+from hypergraph_engine import sort_days
+from dynamic_hypergraph import DynamicHypergraph
+from hypergraph_io import (get_input_columns, get_input_cytokines, get_input_format, read_group_blocks,
+                           get_median_array_from_blocks, read_median_array, match_group_names)
+from hypergraph_metrics import get_hypergraph_metrics, write_metrics
+from hypergraph_profile import stage
+
+# Batch mode: dynamic hypergraphs for many subjects (ex: animals) or cohorts at once. The subjects either come
+# from an identifier column of one input file, which is then read a single time for every subject, or from a
+# directory with one input file per subject. Each subject is processed in its own worker process and writes
+# its own files, named from patterns where {subject} is replaced by the subject and, for images, {window} by the
+# time points. A summary of the hyperedge counts of every subject is written next to them.
+
+EXCEL_PATTERN = '{subject}_Dynamic_Hypergraphs_Grouped_edges.xlsx'
+IMAGE_PATTERN = '{subject}_{window}.png'
+SUMMARY_NAME = 'Dynamic_Hypergraphs_Batch_Summary.csv'
+EDGE_LIST_PATTERN = '{subject}_Dynamic_Hypergraphs_Edge_List.parquet'
+METRICS_PATTERN = '{subject}_Dynamic_Hypergraphs_{metric}.csv'
+
+
+"Function to get the medians of every subject from one input file with a column identifying the subject"
+def read_subject_median_arrays(path, subject_column, cytokines=None, tissues=None, days=None, chunksize=100000,
+                               tissue_column='Tissue', day_column='Day', cache=None):
+    "path: path to the input file"
+    "subject_column: the column identifying the subject or cohort of each sample, ex: 'Animal'"
+    "cytokines: optional list of cytokines; by default every column except the subject, tissue and day"
+    "tissues, days: see get_median_array; by default each subject keeps the tissues and days it has. A requested"
+    "name missing from the whole file raises ValueError, see match_group_names"
+    "chunksize: the number of rows read at a time; None reads the whole file at once"
+    "cache: optional ResultCache reused for the median of each (tissue, day)"
+    "Returns a dictionary from each subject, in order of first appearance, to its MedianArray"
+    if cytokines is None:
+        cytokines = [c for c in get_input_cytokines(get_input_columns(path), tissue_column, day_column)
+                     if c != subject_column]
+    # the file is parsed once and split into blocks per (subject, tissue, day)
+    blocks = read_group_blocks(path, [subject_column, tissue_column, day_column], cytokines, chunksize,
+                               tissue_column, day_column)
+    # the names are matched against the whole file, so a subject may miss some tissue or day
+    if tissues is not None:
+        tissues = match_group_names(tissues, [tissue for subject, tissue, day in blocks], 'tissue')
+    if days is not None:
+        days = match_group_names(days, sort_days(day for subject, tissue, day in blocks), 'day')
+    subject_blocks = {}
+    for (subject, tissue, day), values in blocks.items():
+        subject_blocks.setdefault(subject, {})[(tissue, day)] = values
+    return {str(subject): get_median_array_from_blocks(cur_blocks, cytokines, tissues, days, cache, False)
+            for subject, cur_blocks in subject_blocks.items()}
+
+
+"Function to get the medians of every subject from a directory with one input file per subject"
+def read_directory_median_arrays(directory, cytokines=None, tissues=None, days=None, chunksize=100000,
+                                 tissue_column='Tissue', day_column='Day', cache=None):
+    "directory: a folder of input files (CSV, Parquet or Arrow); the subject is the file name without extension"
+    "the other inputs: see read_subject_median_arrays; each file is read like a single input, so every file"
+    "needs the requested tissues and days"
+    results = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        try:
+            get_input_format(path)
+        except ValueError:
+            continue
+        if os.path.isfile(path):
+            results[os.path.splitext(name)[0]] = read_median_array(path, cytokines, tissues, days, chunksize,
+                                                                   tissue_column, day_column, cache)
+    return results
+
+
+"Function to make and save the dynamic hypergraphs of one subject"
+def run_subject(subject, medians, output_directory='.', window=3, thresholds=(0.7, 0.95),
+                excel_pattern=EXCEL_PATTERN, image_pattern=IMAGE_PATTERN, cache=None, edge_list_pattern=None,
+                streaming_excel=False, metrics_pattern=None):
+    "subject: the name of the subject"
+    "medians: the MedianArray of the subject"
+    "output_directory: the folder the files are written to"
+    "window: the number of consecutive time points in each time interval"
+    "thresholds: the edge strengths, see bin_correlations"
+    "excel_pattern, image_pattern: the file names of the outputs, see the top of this file; None skips the output"
+    "cache: optional ResultCache"
+    "edge_list_pattern: optional file name of the long edge list, see DynamicHypergraph.to_edge_list"
+    "streaming_excel: write the Excel file row by row, see DynamicHypergraph.to_excel"
+    "metrics_pattern: optional file name of each metric, {metric} is filled in, see hypergraph_metrics.py"
+    "Returns the hyperedge counts of the subject, see DynamicHypergraph.get_edge_counts"
+    hypergraph = DynamicHypergraph.from_medians(medians, window, thresholds, cache)
+    if excel_pattern is not None:
+        hypergraph.to_excel(os.path.join(output_directory, excel_pattern.format(subject=subject)), streaming_excel)
+    if edge_list_pattern is not None:
+        hypergraph.to_edge_list(os.path.join(output_directory, edge_list_pattern.format(subject=subject)))
+    if metrics_pattern is not None:
+        path_pattern = metrics_pattern.format(subject=str(subject).replace('%', '%%'), metric='%s')
+        write_metrics(get_hypergraph_metrics(hypergraph), os.path.join(output_directory, path_pattern))
+    if image_pattern is not None:
+        from hypergraph_render import render_dynamic_hypergraphs
+        path_pattern = image_pattern.format(subject=str(subject).replace('%', '%%'), window='%s')
+        # the subjects already run in parallel, so each draws its images in its own process
+        render_dynamic_hypergraphs(hypergraph, os.path.join(output_directory, path_pattern), 1, cache)
+    summary = hypergraph.get_edge_counts()
+    summary.insert(0, 'Subject', subject)
+    return summary
+
+
+"Function to make and save the dynamic hypergraphs of many subjects in a process pool"
+def run_batch(medians_by_subject, output_directory='.', window=3, thresholds=(0.7, 0.95),
+              excel_pattern=EXCEL_PATTERN, image_pattern=IMAGE_PATTERN, workers=None, cache=None,
+              summary_name=SUMMARY_NAME, edge_list_pattern=None, streaming_excel=False, metrics_pattern=None):
+    "medians_by_subject: a dictionary from each subject to its MedianArray, see read_subject_median_arrays"
+    "output_directory: the folder the files are written to; it is created when missing"
+    "window, thresholds, excel_pattern, image_pattern, cache, edge_list_pattern, streaming_excel,"
+    "metrics_pattern: see run_subject"
+    "workers: the number of processes; None uses every core and 1 runs every subject in this process"
+    "summary_name: the file name of the combined summary; None skips it"
+    "Returns the combined summary of every subject as one data frame"
+    os.makedirs(output_directory, exist_ok=True)
+    subjects = list(medians_by_subject)
+    arguments = [(subject, medians_by_subject[subject], output_directory, window, thresholds, excel_pattern,
+                  image_pattern, cache, edge_list_pattern, streaming_excel, metrics_pattern) for subject in subjects]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(arguments))
+    with stage('batch', subjects=len(subjects), workers=max(workers, 1)) as counts:
+        if workers <= 1:
+            summaries = [run_subject(*cur_arguments) for cur_arguments in arguments]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                summaries = list(pool.map(run_subject, *zip(*arguments)))
+        summary = pandas.concat(summaries, ignore_index=True) if summaries else pandas.DataFrame()
+        if len(summary):
+            counts['hyperedges'] = summary['Cytokines'].sum()
+    if summary_name is not None:
+        summary.to_csv(os.path.join(output_directory, summary_name), index=False)
+    return summary
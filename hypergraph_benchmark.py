@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import gc
+import itertools
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy
+import pandas
+from hypergraph_engine import get_median_array, get_window_correlations, get_windows
+from hypergraph_io import read_median_array, read_group_blocks
+from dynamic_hypergraph import DynamicHypergraph
+from hypergraph_metrics import get_hypergraph_metrics
+from hypergraph_permutation import get_sample_permutation_pvalues
+from hypergraph_bootstrap import get_bootstrap_stability
+from hypergraph_lagged import get_lagged_correlations
+
+# Benchmarks of each stage of the dynamic hypergraph pipeline on synthetic data. The synthetic inputs follow the
+# layout of the real input (a Tissue column, a Day column, then one column per mediator) and are varied in the
+# number of tissues, time points, samples per time point and cytokines. Every stage is timed (best of a number
+# of repeats) and its peak memory is measured with tracemalloc in one extra run. The results are appended to a
+# CSV file with one row per (case, stage), so runs before and after a change can be compared with
+# compare_benchmarks.
+#
+# Example: python hypergraph_benchmark.py --cytokines 20 200 --days 11 31 --output benchmark_results.csv
+
+# The first three tissues get the names used by the images, so the image stage works on synthetic data
+TISSUE_NAMES = ['Muscle', 'Skin', 'Plasma']
+STAGES = ['read', 'medians', 'correlations', 'grouping', 'metrics', 'permutations', 'bootstrap', 'lagged',
+          'excel', 'excel streaming', 'edge list', 'images', 'excel end-to-end', 'images end-to-end']
+# the number of sample permutations of the 'permutations' stage and of replicates of the 'bootstrap' stage
+N_PERMUTATIONS = 100
+N_REPLICATES = 100
+
+
+"Function to make a synthetic input in the layout of the real input"
+def generate_synthetic_input(n_tissues=3, n_days=11, n_samples=4, n_cytokines=20, seed=0):
+    "n_tissues: the number of tissues; the first three are Muscle, Skin and Plasma, then Tissue4, Tissue5, ..."
+    "n_days: the number of time points, named 'd0', 'd3', ... with gaps of 2 to 4 days"
+    "n_samples: the number of samples per tissue and time point"
+    "n_cytokines: the number of mediator columns"
+    "seed: seed of the random number generator"
+    "Returns a pandas data frame; each cytokine follows its own random trend in each tissue, so the windows"
+    "hold a mix of strong positive, strong negative and weak correlations"
+    rng = numpy.random.default_rng(seed)
+    tissues = (TISSUE_NAMES + ['Tissue%d' % t for t in range(len(TISSUE_NAMES) + 1, n_tissues + 1)])[:n_tissues]
+    times = numpy.concatenate([[0], numpy.cumsum(rng.integers(2, 5, n_days - 1))])
+    cytokines = ['Cytokine%d' % c for c in range(1, n_cytokines + 1)]
+    # a random walk over the days for every (tissue, cytokine), scaled like pg/mL quantifications
+    trends = numpy.cumsum(rng.normal(0, 1, (n_tissues, n_days, n_cytokines)), axis=1)
+    scale = rng.uniform(10, 1000, (n_tissues, 1, n_cytokines))
+    means = scale * numpy.exp(0.3 * trends)
+    values = means[:, :, None, :] * rng.lognormal(0, 0.2, (n_tissues, n_days, n_samples, n_cytokines))
+    results = pandas.DataFrame(values.reshape(-1, n_cytokines), columns=cytokines)
+    results.insert(0, 'Day', numpy.repeat(numpy.tile(['d%d' % t for t in times], n_tissues), n_samples))
+    results.insert(0, 'Tissue', numpy.repeat(tissues, n_days * n_samples))
+    return results
+
+
+"Function to time a function (best of repeat runs) and measure its peak memory in one more run"
+def measure(function, repeat=3, memory=True):
+    "function: a function without inputs"
+    "repeat: the number of timed runs"
+    "memory: when False the peak memory is not measured"
+    "Returns (seconds, peak bytes allocated by Python and NumPy or None)"
+    seconds = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peak
+
+
+"Function to benchmark every stage of the pipeline on one synthetic input"
+def run_case(n_tissues=3, n_days=11, n_samples=4, n_cytokines=20, window=3, stages=STAGES, repeat=3,
+             memory=True, workers=1, seed=0):
+    "n_tissues, n_days, n_samples, n_cytokines, seed: see generate_synthetic_input"
+    "window: the number of consecutive time points in each window"
+    "stages: the stages to run, see STAGES"
+    "repeat, memory: see measure"
+    "workers: the number of processes drawing images"
+    "Returns a data frame with one row per stage"
+    raw_data = generate_synthetic_input(n_tissues, n_days, n_samples, n_cytokines, seed)
+    cytokines = list(raw_data.columns[2:])
+    directory = tempfile.mkdtemp(prefix='hypergraph_benchmark_')
+    try:
+        input_path = os.path.join(directory, 'input.csv')
+        raw_data.to_csv(input_path, index=False)
+        medians = get_median_array(raw_data, cytokines)
+        blocks = read_group_blocks(input_path, ['Tissue', 'Day'], cytokines)
+        r = get_window_correlations(medians, window)
+        windows = get_windows(medians.days, window)
+        hypergraph = DynamicHypergraph.from_correlations(r, medians.tissues, cytokines, windows)
+        excel_path = os.path.join(directory, 'output.xlsx')
+        edge_list_path = os.path.join(directory, 'edges.parquet')
+        image_pattern = os.path.join(directory, '%s.png')
+
+        def render(cur_hypergraph):
+            from hypergraph_render import render_dynamic_hypergraphs
+            render_dynamic_hypergraphs(cur_hypergraph, image_pattern, workers)
+
+        def excel_end_to_end():
+            cur_medians = read_median_array(input_path)
+            DynamicHypergraph.from_medians(cur_medians, window).to_excel(excel_path)
+
+        def images_end_to_end():
+            cur_medians = read_median_array(input_path, tissues=medians.tissues)
+            render(DynamicHypergraph.from_medians(cur_medians, window))
+
+        functions = {
+            'read': lambda: read_median_array(input_path),
+            'medians': lambda: get_median_array(raw_data, cytokines),
+            'correlations': lambda: get_window_correlations(medians, window),
+            'grouping': lambda: [DynamicHypergraph.from_correlations(r, medians.tissues, cytokines, windows)
+                                 .get_grouped_edges(n) for n in range(len(windows))],
+            'metrics': lambda: get_hypergraph_metrics(hypergraph),
+            'permutations': lambda: get_sample_permutation_pvalues(blocks, medians, window, N_PERMUTATIONS,
+                                                                   workers=workers),
+            'bootstrap': lambda: get_bootstrap_stability(blocks, medians, hypergraph, window, N_REPLICATES,
+                                                         workers=workers),
+            'lagged': lambda: get_lagged_correlations(medians, window),
+            'excel': lambda: hypergraph.to_excel(excel_path),
+            'excel streaming': lambda: hypergraph.to_excel(excel_path, streaming=True),
+            'edge list': lambda: hypergraph.to_edge_list(edge_list_path),
+            'images': lambda: render(hypergraph),
+            'excel end-to-end': excel_end_to_end,
+            'images end-to-end': images_end_to_end,
+        }
+        rows = []
+        for stage in stages:
+            if stage.startswith('images') and n_tissues < len(TISSUE_NAMES):
+                # the image layout needs muscle, skin and plasma
+                continue
+            seconds, peak = measure(functions[stage], repeat, memory)
+            rows.append({'Stage': stage, 'Seconds': seconds, 'Peak bytes': peak})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    results = pandas.DataFrame(rows)
+    for name, value in reversed([('Tissues', n_tissues), ('Days', n_days), ('Samples', n_samples),
+                                 ('Cytokines', n_cytokines), ('Window', window)]):
+        results.insert(0, name, value)
+    return results
+
+
+"Function to benchmark every combination of input sizes and append the results to a CSV file"
+def run_benchmarks(tissues=(3,), days=(11,), samples=(4,), cytokines=(20,), window=3, stages=STAGES, repeat=3,
+                   memory=True, workers=1, output=None, label=None):
+    "tissues, days, samples, cytokines: lists of sizes; every combination is one case"
+    "window, stages, repeat, memory, workers: see run_case"
+    "output: optional CSV file the results are appended to"
+    "label: optional name of this run, ex: a git commit, stored with the results"
+    "Returns the results as a data frame"
+    frames = []
+    for n_tissues, n_days, n_samples, n_cytokines in itertools.product(tissues, days, samples, cytokines):
+        frames.append(run_case(n_tissues, n_days, n_samples, n_cytokines, window, stages, repeat, memory, workers))
+    results = pandas.concat(frames, ignore_index=True)
+    results.insert(0, 'Label', label if label is not None else '')
+    results.insert(1, 'Time', time.strftime('%Y-%m-%d %H:%M:%S'))
+    results['Python'] = platform.python_version()
+    results['NumPy'] = numpy.__version__
+    results['pandas'] = pandas.__version__
+    if output is not None:
+        results.to_csv(output, mode='a', header=not os.path.exists(output), index=False)
+    return results
+
+
+"Function to compare two benchmark runs stage by stage"
+def compare_benchmarks(before, after):
+    "before, after: benchmark results, as data frames or paths of CSV files written by run_benchmarks"
+    "Returns a data frame with the time and peak memory of both runs and their ratio (after / before) for every"
+    "case and stage found in both; when a file holds several runs of a case, the latest one is used"
+    keys = ['Tissues', 'Days', 'Samples', 'Cytokines', 'Window', 'Stage']
+    runs = []
+    for results in (before, after):
+        if not isinstance(results, pandas.DataFrame):
+            results = pandas.read_csv(results)
+        runs.append(results.drop_duplicates(keys, keep='last').set_index(keys)[['Seconds', 'Peak bytes']])
+    results = runs[0].join(runs[1], how='inner', lsuffix=' before', rsuffix=' after')
+    results['Time ratio'] = results['Seconds after'] / results['Seconds before']
+    results['Memory ratio'] = results['Peak bytes after'] / results['Peak bytes before']
+    return results.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dynamic hypergraph pipeline on synthetic data')
+    parser.add_argument('--tissues', type=int, nargs='+', default=[3], help='numbers of tissues')
+    parser.add_argument('--days', type=int, nargs='+', default=[11], help='numbers of time points')
+    parser.add_argument('--samples', type=int, nargs='+', default=[4], help='numbers of samples per time point')
+    parser.add_argument('--cytokines', type=int, nargs='+', default=[20], help='numbers of cytokines')
+    parser.add_argument('--window', type=int, default=3, help='time points per window')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='stages to run')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the best is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--workers', type=int, default=1, help='processes drawing images')
+    parser.add_argument('--output', default='benchmark_results.csv', help='CSV file the results are appended to')
+    parser.add_argument('--label', help='name of this run, ex: a git commit')
+    parser.add_argument('--compare', help='an earlier results file to compare this run with')
+    args = parser.parse_args(argv)
+    results = run_benchmarks(args.tissues, args.days, args.samples, args.cytokines, args.window, args.stages,
+                             args.repeat, not args.no_memory, args.workers, args.output, args.label)
+    with pandas.option_context('display.width', 200, 'display.max_columns', 20):
+        print(results.drop(columns=['Python', 'NumPy', 'pandas']).to_string(index=False))
+        if args.compare:
+            print(compare_benchmarks(args.compare, results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import warnings
+from collections import namedtuple
+import numpy
+from hypergraph_engine import get_pearson_r, get_windows, bin_correlations, get_membership_masks
+from hypergraph_permutation import map_bounded
+from hypergraph_profile import stage
+
+# Bootstrap stability of the hyperedges. The median of each (tissue, day) hides how much a hyperedge depends on
+# single animals, so the raw samples of every (tissue, day) are resampled with replacement many times, and each
+# replicate goes through the same medians, window correlations and edge strengths as the real data. A batch of
+# replicates is computed at once: the resampled medians are an array of shape (replicates, tissues, days,
+# cytokines) and everything after that works on the whole batch. Only counts are kept between batches, so the
+# memory depends on the batch size and not on the number of replicates. The batches can run in a process pool;
+# the raw samples are handed to each process once.
+#
+# The resampling indices come from one seeded generator per (tissue, day), drawn row by row, so a seed gives the
+# same result whatever the batch size or the number of workers.
+
+# BootstrapStability holds how often the hyperedges of a DynamicHypergraph appear over the replicates
+# tissue: array of shape (tissues, windows, levels, cytokines), the share of replicates where the cytokine has an
+#     edge of that strength in that tissue
+# hyperedge: array of shape (windows, levels, cytokines), the share of replicates where the cytokine joins
+#     exactly the same set of tissues as in the hypergraph (or, for a cytokine without a hyperedge, none)
+# replicates: the number of replicates
+BootstrapStability = namedtuple('BootstrapStability', ['tissue', 'hyperedge', 'replicates'])
+
+# raw samples of the current process, set once per process by _set_blocks
+_blocks = None
+
+
+"Function to get how often each hyperedge of a DynamicHypergraph appears when the raw samples are resampled"
+def get_bootstrap_stability(blocks, medians, hypergraph, window=3, n_replicates=1000, seed=0, batch_size=100,
+                            workers=1):
+    "blocks: a dictionary from (tissue, day) to an array of raw values of shape (samples, cytokines), see"
+    "hypergraph_io.read_group_blocks"
+    "medians: the MedianArray of these blocks"
+    "hypergraph: the DynamicHypergraph of medians, see DynamicHypergraph.from_medians; its edge strengths are"
+    "used for the replicates. Pass it before any significance filter (see get_significant_hypergraph), since the"
+    "replicates are not filtered"
+    "window: the number of consecutive time points in each window"
+    "n_replicates: the number of bootstrap replicates"
+    "seed: seed of the random number generator"
+    "batch_size: the number of replicates computed at once; a batch holds batch_size x samples x cytokines"
+    "values of one (tissue, day), and batch_size x tissues x days x cytokines medians"
+    "workers: the number of processes; None uses every core and 1 computes in this process"
+    "Returns a BootstrapStability"
+    if n_replicates < 1:
+        raise ValueError("At least one replicate is needed, got %d" % n_replicates)
+    get_windows(medians.days, window)
+    n_tissues, n_days = len(medians.tissues), len(medians.days)
+    # the raw samples on the grid of medians; (tissue, day) pairs without samples stay NaN in every replicate
+    grid = [[None if (tissue, day) not in blocks else numpy.asarray(blocks[(tissue, day)], dtype=numpy.float64)
+             for day in medians.days] for tissue in medians.tissues]
+    generators = numpy.random.SeedSequence(seed).spawn(n_tissues * n_days)
+    rngs = [numpy.random.default_rng(g) for g in generators]
+    thresholds = [level for level in hypergraph.levels if level > 0]
+    observed = numpy.asarray(hypergraph.masks, dtype=numpy.int64)
+
+    def iter_tasks():
+        for start in range(0, n_replicates, batch_size):
+            size = min(batch_size, n_replicates - start)
+            indices = {}
+            for t in range(n_tissues):
+                for d in range(n_days):
+                    if grid[t][d] is not None:
+                        n = len(grid[t][d])
+                        indices[(t, d)] = (rngs[t * n_days + d].random((size, n)) * n).astype(numpy.intp)
+            yield (indices, size, medians.times, window, thresholds, hypergraph.levels, observed)
+
+    tissue_counts = numpy.zeros((n_tissues,) + observed.shape, dtype=numpy.int64)
+    hyperedge_counts = numpy.zeros(observed.shape, dtype=numpy.int64)
+    with stage('bootstrap', replicates=n_replicates, tissues=n_tissues, days=n_days,
+               cytokines=len(medians.cytokines)):
+        try:
+            for cur_tissue, cur_hyperedge in map_bounded(_count_bootstrap_batch, iter_tasks(), workers,
+                                                         _set_blocks, (grid,)):
+                tissue_counts += cur_tissue
+                hyperedge_counts += cur_hyperedge
+        finally:
+            # without a process pool the samples were handed to this process
+            _set_blocks(None)
+    return BootstrapStability(tissue_counts / n_replicates, hyperedge_counts / n_replicates, n_replicates)
+
+
+"Function to store the bootstrap stability on a DynamicHypergraph"
+def attach_stability(hypergraph, stability):
+    "hypergraph: a DynamicHypergraph"
+    "stability: its BootstrapStability, see get_bootstrap_stability"
+    "The shares then appear in hypergraph.get_edge_list as 'Tissue stability' and 'Hyperedge stability'"
+    hypergraph.stability = stability
+    return hypergraph
+
+
+def _set_blocks(grid):
+    global _blocks
+    _blocks = grid
+
+
+def _get_batch_medians(indices, size, n_tissues, n_days, n_cytokines):
+    # medians of shape (replicates, tissues, days, cytokines) of one batch of resampled blocks
+    medians = numpy.full((size, n_tissues, n_days, n_cytokines), numpy.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for (t, d), rows in indices.items():
+            medians[:, t, d] = numpy.nanmedian(_blocks[t][d][rows], axis=1)
+    return medians
+
+
+def _count_bootstrap_batch(indices, size, times, window, thresholds, levels, observed):
+    medians = _get_batch_medians(indices, size, len(_blocks), len(times), observed.shape[-1])
+    # r of shape (replicates, tissues, windows, cytokines), as get_window_correlations for every replicate
+    y = numpy.lib.stride_tricks.sliding_window_view(medians, window, axis=2)
+    x = numpy.lib.stride_tricks.sliding_window_view(numpy.asarray(times, dtype=numpy.float64), window)
+    r = get_pearson_r(x[None, None, :, None, :], y)
+    binned = bin_correlations(r, thresholds)
+    # membership of shape (tissues, replicates, windows, levels, cytokines)
+    membership = binned.transpose(1, 0, 2, 3)[:, :, :, None, :] == numpy.asarray(levels)[:, None]
+    masks = get_membership_masks(membership)
+    return membership.sum(axis=1), (masks == observed).sum(axis=0)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import hashlib
+import os
+import pickle
+import tempfile
+import numpy
+from hypergraph_engine import get_block_medians, get_windows, get_window_correlations
+
+# A persistent, size-bounded cache of intermediate results. Every entry is keyed by a hash of the data it was
+# computed from and the parameters used, so an entry never goes stale: when a new time point is added, only the
+# results that depend on it get new keys and are computed again. The cache holds
+#   - the median of each (tissue, day), keyed by the raw values of that tissue and day
+#   - Pearson's r of each window, keyed by the medians of the days in that window
+#   - the image of each window, keyed by its hyperedges, so unchanged figures are not drawn again
+# When the files in the cache directory grow beyond max_bytes, the least recently used entries are removed.
+
+# Bump this when the way any cached result is computed changes, so old entries are no longer found
+CACHE_VERSION = 1
+
+
+"Function to hash data and parameters into a cache key"
+def get_cache_key(*parts):
+    "parts: the values the result depends on; numpy arrays, strings, numbers and lists or tuples of those"
+    digest = hashlib.sha256()
+    digest.update(str(CACHE_VERSION).encode())
+    for part in parts:
+        _update_digest(digest, part)
+    return digest.hexdigest()
+
+
+def _update_digest(digest, part):
+    if isinstance(part, numpy.ndarray):
+        part = numpy.ascontiguousarray(part)
+        digest.update(b'array%s%s' % (part.dtype.str.encode(), str(part.shape).encode()))
+        digest.update(part.tobytes())
+    elif isinstance(part, (list, tuple)):
+        digest.update(b'list%d' % len(part))
+        for item in part:
+            _update_digest(digest, item)
+    elif isinstance(part, dict):
+        _update_digest(digest, sorted(part.items()))
+    else:
+        text = repr(part).encode()
+        digest.update(b'%d:%s' % (len(text), text))
+
+
+class ResultCache:
+    "A directory of pickled results, keyed by get_cache_key and bounded in size"
+
+    def __init__(self, directory, max_bytes=512 * 2**20):
+        "directory: the folder holding the cache; it is created when missing"
+        "max_bytes: the largest total size of the cached files before the least recently used are removed"
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # total size of the entries, counted on the first write and then kept up to date
+        self.size = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_path(self, key):
+        "key: a cache key; returns the file the entry is stored in"
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key, default=None):
+        "key: a cache key"
+        "default: returned when the key is not in the cache"
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        # mark the entry as recently used for the eviction order; another process may have evicted it meanwhile
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        "key: a cache key"
+        "value: any picklable result"
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so a crash never leaves a half written entry behind
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if self.size is None:
+            self.evict()
+        else:
+            try:
+                self.size += os.path.getsize(path)
+            except FileNotFoundError:
+                # evicted by another process sharing the directory
+                return
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        "Removes the least recently used entries until the cache fits in max_bytes"
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pkl'):
+                    # processes sharing the directory can remove entries while this one walks it
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                    total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+    def clear(self):
+        "Removes every entry"
+        self.max_bytes, max_bytes = 0, self.max_bytes
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+
+"Function to get the median of each (tissue, day) block of raw values, reusing cached medians"
+def get_cached_medians(blocks, cytokines, cache):
+    "blocks: a dictionary from (tissue, day) to an array of raw values of shape (samples, cytokines)"
+    "cytokines: a list of cytokines"
+    "cache: a ResultCache"
+    "Returns a dictionary from (tissue, day) to an array with the median of each cytokine"
+    results = {}
+    for group, values in blocks.items():
+        key = get_cache_key('median', list(cytokines), values)
+        medians = cache.get(key)
+        if medians is None:
+            medians = get_block_medians(values)
+            cache.put(key, medians)
+        results[group] = medians
+    return results
+
+
+"Function to get Pearson's r of every window, only computing the windows whose medians are not cached"
+def get_cached_window_correlations(medians, window, cache):
+    "medians: a MedianArray"
+    "window: the number of consecutive time points in each window"
+    "cache: a ResultCache"
+    "Returns the same array as get_window_correlations"
+    windows = get_windows(medians.days, window)
+    values = numpy.asarray(medians.values, dtype=numpy.float64)
+    keys = [get_cache_key('window r', medians.tissues, medians.cytokines, medians.times[n:n + window],
+                          values[:, n:n + window]) for n in range(len(windows))]
+    r = numpy.full((len(medians.tissues), len(windows), len(medians.cytokines)), numpy.nan)
+    missing = []
+    for n, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is None:
+            missing.append(n)
+        else:
+            r[:, n] = cached
+    if missing:
+        # the windows with a new or changed day are computed together in one batched call
+        computed = get_window_correlations(medians, window, missing)
+        for i, n in enumerate(missing):
+            r[:, n] = computed[:, i]
+            cache.put(keys[n], computed[:, i])
+    return r
+
+
+"Function to get the cache key of a rendered image from the hyperedges drawn in it"
+def get_figure_key(positive_edges, negative_edges, strength, title):
+    "see render_hypergraph_figure"
+    return get_cache_key('figure', positive_edges, negative_edges, strength, title)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import itertools
+import re
+import warnings
+from collections import namedtuple
+import numpy
+import pandas
+
+# Vectorized building blocks for the dynamic hypergraph pipeline in VCA_Dynamic_Hypergraphs.py.
+# Instead of filtering the raw data once per tissue, cytokine and day, every step here works on one
+# compact array of median values indexed as [tissue, day, cytokine].
+
+
+# MedianArray bundles the median values with the labels of each axis
+# tissues: list of tissue names in the order of the first axis, ex: ['Muscle', 'Skin', 'Plasma']
+# days: list of time point names in chronological order, ex: ['d0', 'd3', 'd5']
+# times: list of the time points as integers, ex: [0, 3, 5]
+# cytokines: list of cytokine names in the order of the last axis
+# values: numpy array of shape (tissues, days, cytokines); NaN where a tissue has no samples on a day
+MedianArray = namedtuple('MedianArray', ['tissues', 'days', 'times', 'cytokines', 'values'])
+
+
+"Function to convert a time point name into an integer, ex: 'd11' -> 11"
+def get_day_number(day):
+    "day: a string naming the time point, the first number in the string is used as the day"
+    match = re.search(r'-?\d+', str(day))
+    if match is None:
+        raise ValueError("Cannot read a time point from the day label %r" % (day,))
+    return int(match.group())
+
+
+"Function to sort time point names chronologically, ex: ['d3', 'd11', 'd0'] -> ['d0', 'd3', 'd11']"
+def sort_days(days):
+    "days: an iterable of time point names"
+    return sorted(set(days), key=get_day_number)
+
+
+"Function to get the median value of every cytokine in every tissue at every time point in one pass"
+def get_median_array(raw_data, cytokines, tissues=None, days=None, tissue_column='Tissue', day_column='Day'):
+    "raw_data: a pandas data frame of all samples; one column names the tissue, one names the day and the"
+    "remaining columns are cytokine quantifications"
+    "cytokines: a list of all the cytokines in the data table"
+    "tissues: optional list of tissues to keep (and their order); by default every tissue in the data, in"
+    "order of first appearance"
+    "days: optional list of time points to keep; by default every day in the data, sorted chronologically"
+    "Returns a MedianArray"
+    if tissues is None:
+        tissues = list(pandas.unique(raw_data[tissue_column]))
+    if days is None:
+        days = sort_days(raw_data[day_column])
+    tissues = list(tissues)
+    days = list(days)
+    cytokines = list(cytokines)
+    grouped = raw_data.groupby([tissue_column, day_column], sort=False, observed=True)[cytokines].median()
+    full_index = pandas.MultiIndex.from_product([tissues, days], names=[tissue_column, day_column])
+    grouped = grouped.reindex(full_index)
+    values = grouped.to_numpy(dtype=numpy.float64).reshape(len(tissues), len(days), len(cytokines))
+    times = [get_day_number(d) for d in days]
+    return MedianArray(tissues, days, times, cytokines, values)
+
+
+"Function to get the median of each cytokine from a block of raw values, skipping missing values like pandas"
+def get_block_medians(values):
+    "values: an array of shape (samples, cytokines)"
+    "Returns a float64 array with one median per cytokine, NaN for a cytokine without any value"
+    values = numpy.asarray(values, dtype=numpy.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return numpy.nanmedian(values, axis=0)
+
+
+"Function to get the medians of one tissue as a data frame: a 'Day' column followed by one column per cytokine"
+def get_tissue_median_frame(medians, tissue):
+    "medians: a MedianArray"
+    "tissue: the name of the tissue, ex: 'Muscle'"
+    results = pandas.DataFrame(medians.values[medians.tissues.index(tissue)], columns=medians.cytokines)
+    results.insert(0, 'Day', medians.days)
+    return results
+
+
+"Function to get Pearson's r between x and y along the last axis, skipping missing values like DataFrame.corr"
+def get_pearson_r(x, y):
+    "x: array of time points; broadcast against y, the last axis holds the observations"
+    "y: array of cytokine values; the last axis holds the observations, every other axis is a separate series"
+    "Returns an array of r values with the last axis removed; NaN where fewer than two paired values exist or"
+    "where one of the series is constant"
+    x, y = numpy.broadcast_arrays(numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64))
+    valid = ~(numpy.isnan(x) | numpy.isnan(y))
+    n = valid.sum(axis=-1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        # centre each series on its own mean before summing products (same two-pass scheme as DataFrame.corr)
+        x_dev = numpy.where(valid, x - (numpy.where(valid, x, 0).sum(axis=-1) / n)[..., None], 0)
+        y_dev = numpy.where(valid, y - (numpy.where(valid, y, 0).sum(axis=-1) / n)[..., None], 0)
+        r = (x_dev * y_dev).sum(axis=-1) / numpy.sqrt((x_dev * x_dev).sum(axis=-1) * (y_dev * y_dev).sum(axis=-1))
+    return numpy.where(n >= 2, r, numpy.nan)
+
+
+"Function to get the time points of every sliding window, ex: [['d0', 'd3', 'd5'], ['d3', 'd5', 'd7'], ...]"
+def get_windows(days, window=3):
+    "days: a list of time points in chronological order"
+    "window: the number of consecutive time points in each window"
+    if window < 2 or window > len(days):
+        raise ValueError("A window must hold between 2 and %d time points, got %d" % (len(days), window))
+    return [list(days[n:n + window]) for n in range(len(days) - window + 1)]
+
+
+"Function to get Pearson's r between time and every cytokine, in every tissue, over every sliding window"
+def get_window_correlations(medians, window=3, selected=None):
+    "medians: a MedianArray"
+    "window: the number of consecutive time points in each window"
+    "selected: optional list of window indices to compute; by default every window"
+    "Returns an array of shape (tissues, windows, cytokines); window n covers medians.days[n:n + window]"
+    "When selected is given, the second axis holds only the selected windows, in that order"
+    get_windows(medians.days, window)
+    values = numpy.asarray(medians.values, dtype=numpy.float64)
+    times = numpy.asarray(medians.times, dtype=numpy.float64)
+    # views of shape (tissues, windows, cytokines, window) and (windows, window); nothing is copied here
+    y = numpy.lib.stride_tricks.sliding_window_view(values, window, axis=1)
+    x = numpy.lib.stride_tricks.sliding_window_view(times, window)
+    if selected is not None:
+        y = y[:, selected]
+        x = x[selected]
+    return get_pearson_r(x[None, :, None, :], y)
+
+
+"Function to snap r onto the edge strengths used in the hypergraphs"
+def bin_correlations(r, thresholds=(0.7, 0.95)):
+    "r: an array of Pearson's r values"
+    "thresholds: the edge strengths; |r| is rounded down onto the largest threshold it reaches, keeping its sign."
+    "With the defaults: 0.7 <= r < 0.95 -> 0.7, r >= 0.95 -> 0.95, and the same for negative r"
+    "Returns an array shaped like r, NaN where |r| is below every threshold"
+    r = numpy.asarray(r, dtype=numpy.float64)
+    abs_r = numpy.abs(r)
+    binned = numpy.full(r.shape, numpy.nan)
+    for threshold in sorted(thresholds):
+        binned = numpy.where(abs_r >= threshold, numpy.sign(r) * threshold, binned)
+    return binned
+
+
+"Function to stack per-tissue median frames (as made by get_median_for_tissue) into a MedianArray"
+def stack_tissue_median_frames(frames, tissues, cytokines):
+    "frames: a list of data frames with a 'Day' column and one column per cytokine, all with the same days"
+    "tissues: the name of the tissue of each frame, ex: ['Muscle', 'Skin', 'Plasma']"
+    "cytokines: a list of cytokines"
+    days = list(frames[0]['Day'])
+    values = numpy.stack([frame[list(cytokines)].to_numpy(dtype=numpy.float64) for frame in frames])
+    return MedianArray(list(tissues), days, [get_day_number(d) for d in days], list(cytokines), values)
+
+
+# Hyperedges group the cytokines found in the same set of tissues. A set of tissues is encoded as an integer
+# bitmask: bit t is set when the cytokine is found in tissues[t], ex: with ['muscle', 'skin', 'plasma'] the
+# mask 0b101 = 5 means 'muscle and plasma'.
+
+"Function to name a set of tissues the way the hypergraph tables do, ex: 'muscle', 'muscle and skin',"
+"'muscle, skin, and plasma'"
+def get_tissue_set_name(names):
+    "names: a list of tissue names"
+    names = list(names)
+    if len(names) < 3:
+        return ' and '.join(names)
+    return '%s, and %s' % (', '.join(names[:-1]), names[-1])
+
+
+"Function to list every non-empty set of tissues as a bitmask, single tissues first, then pairs, and so on"
+def get_tissue_set_masks(tissues):
+    "tissues: a list of tissue names"
+    masks = []
+    for size in range(1, len(tissues) + 1):
+        for combination in itertools.combinations(range(len(tissues)), size):
+            masks.append(sum(1 << t for t in combination))
+    return masks
+
+
+"Function to get the name of the set of tissues encoded by a bitmask"
+def get_tissue_mask_name(mask, tissues):
+    "mask: an integer bitmask over tissues"
+    "tissues: a list of tissue names"
+    return get_tissue_set_name([tissue for t, tissue in enumerate(tissues) if mask >> t & 1])
+
+
+"Function to combine per-tissue membership flags into one bitmask per cytokine"
+def get_membership_masks(membership):
+    "membership: a boolean array whose first axis is the tissue, ex: shape (tissues, cytokines)"
+    "Returns an integer array with the first axis removed"
+    membership = numpy.asarray(membership, dtype=bool)
+    if len(membership) > 63:
+        raise ValueError("At most 63 tissues fit in a bitmask, got %d" % len(membership))
+    bits = numpy.left_shift(numpy.int64(1), numpy.arange(len(membership), dtype=numpy.int64))
+    return numpy.tensordot(bits, membership.astype(numpy.int64), axes=1)
+
+
+"Function to sort cytokines into groups of tissues by their bitmask, in one pass over the cytokines"
+def group_by_tissue_mask(cytokines, masks, tissues, include_empty=True):
+    "cytokines: a list of cytokine names"
+    "masks: the bitmask of each cytokine; cytokines with a mask of 0 are not in any group"
+    "tissues: a list of tissue names, tissues[t] is bit t of the masks"
+    "include_empty: when True every set of tissues is a key, even when no cytokine falls into it; set this to"
+    "False for many tissues, where the 2^k - 1 empty sets would dominate"
+    "Returns a dictionary from the name of each set of tissues (see get_tissue_set_name) to a list of"
+    "cytokines, keeping the order of cytokines"
+    buckets = {}
+    for cytokine, mask in zip(cytokines, masks):
+        if mask:
+            buckets.setdefault(int(mask), []).append(cytokine)
+    if include_empty:
+        ordered_masks = get_tissue_set_masks(tissues)
+    else:
+        ordered_masks = sorted(buckets, key=lambda mask: (bin(mask).count('1'), _mask_order_key(mask)))
+    return {get_tissue_mask_name(mask, tissues): buckets.get(mask, []) for mask in ordered_masks}
+
+
+def _mask_order_key(mask):
+    # the tissue indices of a mask, so masks of the same size sort like itertools.combinations
+    return [t for t in range(mask.bit_length()) if mask >> t & 1]
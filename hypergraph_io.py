@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import numpy
+import pandas
+from hypergraph_engine import MedianArray, sort_days, get_day_number, get_block_medians
+from hypergraph_cache import get_cached_medians
+from hypergraph_profile import stage
+
+# Reading of the input spreadsheet. The input is organized as described in VCA_Dynamic_Hypergraphs.py: one
+# column names the tissue, one names the time point and every remaining column is an inflammatory mediator.
+# Tissue and Day are read as categoricals and every mediator as float32. The input can be a CSV file or a
+# Parquet / Arrow IPC (Feather) file; the columnar formats are read through memory maps, so converting a CSV
+# once with convert_csv_to_parquet lets repeated runs skip CSV parsing altogether.
+
+CSV_EXTENSIONS = ('.csv', '.txt')
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+
+"Function to get the format of an input file from its extension: 'csv', 'parquet' or 'arrow'"
+def get_input_format(path):
+    "path: path to the input file"
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension in CSV_EXTENSIONS:
+        return 'csv'
+    if extension in PARQUET_EXTENSIONS:
+        return 'parquet'
+    if extension in ARROW_EXTENSIONS:
+        return 'arrow'
+    raise ValueError("Unknown input format %r, expected one of %s"
+                     % (extension, ', '.join(CSV_EXTENSIONS + PARQUET_EXTENSIONS + ARROW_EXTENSIONS)))
+
+
+"Function to get the column names of an input file without reading its rows"
+def get_input_columns(path):
+    "path: path to the input file"
+    input_format = get_input_format(path)
+    if input_format == 'csv':
+        return list(pandas.read_csv(path, nrows=0).columns)
+    import pyarrow
+    if input_format == 'parquet':
+        import pyarrow.parquet
+        return list(pyarrow.parquet.read_schema(path, memory_map=True).names)
+    import pyarrow.ipc
+    with pyarrow.memory_map(str(path), 'r') as source:
+        return list(pyarrow.ipc.open_file(source).schema.names)
+
+
+"Function to get the dtype of every input column: categoricals for the tissue and day, float32 for mediators"
+def get_input_dtypes(columns, tissue_column='Tissue', day_column='Day', label_columns=()):
+    "columns: the column names of the input"
+    "tissue_column, day_column: the names of the columns with the tissue and the time point"
+    "label_columns: other columns read as categoricals, ex: a column identifying the subject"
+    dtypes = {c: numpy.float32 for c in columns}
+    for c in (tissue_column, day_column) + tuple(label_columns):
+        dtypes[c] = 'category'
+    return dtypes
+
+
+"Function to get the cytokine columns of an input: every column except the tissue and the day"
+def get_input_cytokines(columns, tissue_column='Tissue', day_column='Day'):
+    "columns: the column names of the input"
+    return [c for c in columns if c not in (tissue_column, day_column)]
+
+
+"Function to read an input file in typed chunks of rows"
+def iter_input_chunks(path, chunksize=100000, columns=None, tissue_column='Tissue', day_column='Day',
+                      label_columns=()):
+    "path: path to the input file"
+    "chunksize: the number of rows in each chunk"
+    "columns: optional list of columns to read; by default every column"
+    "label_columns: see get_input_dtypes"
+    "Yields pandas data frames with the dtypes of get_input_dtypes"
+    if columns is None:
+        columns = get_input_columns(path)
+    columns = list(columns)
+    dtypes = get_input_dtypes(columns, tissue_column, day_column, label_columns)
+    input_format = get_input_format(path)
+    if input_format == 'csv':
+        for chunk in pandas.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunksize):
+            yield chunk[columns]
+        return
+    import pyarrow
+    if input_format == 'parquet':
+        import pyarrow.parquet
+        batches = pyarrow.parquet.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize,
+                                                                                   columns=columns)
+        for batch in batches:
+            yield batch.to_pandas().astype(dtypes)
+        return
+    import pyarrow.ipc
+    with pyarrow.memory_map(str(path), 'r') as source:
+        table = pyarrow.ipc.open_file(source).read_all().select(columns)
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas().astype(dtypes)
+
+
+"Function to read a whole input file into one typed data frame"
+def read_input(path, columns=None, tissue_column='Tissue', day_column='Day', label_columns=()):
+    "path: path to the input file"
+    "columns: optional list of columns to read; by default every column"
+    "label_columns: see get_input_dtypes"
+    if columns is None:
+        columns = get_input_columns(path)
+    columns = list(columns)
+    dtypes = get_input_dtypes(columns, tissue_column, day_column, label_columns)
+    input_format = get_input_format(path)
+    if input_format == 'csv':
+        return pandas.read_csv(path, usecols=columns, dtype=dtypes)[columns]
+    if input_format == 'parquet':
+        return pandas.read_parquet(path, columns=columns, memory_map=True).astype(dtypes)
+    import pyarrow.feather
+    return pyarrow.feather.read_table(path, columns=columns, memory_map=True).to_pandas().astype(dtypes)
+
+
+"Function to read the cytokine values of an input file grouped by the values of some columns"
+def read_group_blocks(path, group_columns, cytokines, chunksize=100000, tissue_column='Tissue', day_column='Day'):
+    "path: path to the input file"
+    "group_columns: the columns to group by, ex: ['Tissue', 'Day']"
+    "cytokines: a list of cytokines"
+    "chunksize: the number of rows read at a time; None reads the whole file at once"
+    "Returns a dictionary from each tuple of group values, in order of first appearance, to a float32 array of"
+    "shape (samples, cytokines)"
+    "Each chunk is reduced to float32 blocks per group and the text columns are dropped, so the full raw table"
+    "is never held"
+    group_columns = list(group_columns)
+    columns = group_columns + [c for c in cytokines if c not in group_columns]
+    label_columns = [c for c in group_columns if c not in (tissue_column, day_column)]
+    if chunksize is None:
+        chunks = [read_input(path, columns, tissue_column, day_column, label_columns)]
+    else:
+        chunks = iter_input_chunks(path, chunksize, columns, tissue_column, day_column, label_columns)
+    blocks = {}
+    with stage('read', cytokines=len(cytokines)) as counts:
+        n_rows = 0
+        for chunk in chunks:
+            values = chunk[list(cytokines)].to_numpy(dtype=numpy.float32)
+            groups = chunk.groupby(group_columns, sort=False, observed=True).indices
+            for key, rows in groups.items():
+                blocks.setdefault(key, []).append(values[rows])
+            n_rows += len(chunk)
+        results = {key: numpy.concatenate(group_blocks) for key, group_blocks in blocks.items()}
+        counts['rows'] = n_rows
+        counts['groups'] = len(results)
+    return results
+
+
+"Function to match requested tissue or day names to the names of an input, ignoring case"
+def match_group_names(names, available, kind='tissue'):
+    "names: the requested names, ex: ['muscle', 'skin']"
+    "available: the names found in the input, ex: ['Muscle', 'Skin', 'Plasma']"
+    "kind: what the names are, for the error message, ex: 'tissue' or 'day'"
+    "Returns the input spelling of each requested name, ex: ['Muscle', 'Skin']"
+    "Raises ValueError naming every requested name the input does not have"
+    available = list(dict.fromkeys(available))
+    folded = {}
+    for name in available:
+        folded.setdefault(str(name).lower(), []).append(name)
+    results = []
+    missing = []
+    for name in names:
+        if name in available:
+            results.append(name)
+        elif len(folded.get(str(name).lower(), [])) == 1:
+            results.append(folded[str(name).lower()][0])
+        else:
+            missing.append(str(name))
+    if missing:
+        raise ValueError("The input has no %s %s; it has %s" % (kind, ', '.join(missing),
+                                                                ', '.join(str(a) for a in available)))
+    return results
+
+
+"Function to reduce the (tissue, day) blocks of raw values into a MedianArray"
+def get_median_array_from_blocks(blocks, cytokines, tissues=None, days=None, cache=None, match_names=True):
+    "blocks: a dictionary from (tissue, day) to an array of raw values, see read_group_blocks"
+    "cytokines: a list of cytokines"
+    "tissues, days: see get_median_array"
+    "cache: optional ResultCache (see hypergraph_cache.py) reused for the median of each (tissue, day)"
+    "match_names: when True the tissues and days are matched to the blocks ignoring case and a name without any"
+    "block raises ValueError (see match_group_names); when False they are used as given and a (tissue, day)"
+    "without samples stays NaN, ex: one subject of a batch missing a time point"
+    if tissues is None:
+        tissues = list(dict.fromkeys(tissue for tissue, day in blocks))
+    elif match_names:
+        tissues = match_group_names(tissues, [tissue for tissue, day in blocks], 'tissue')
+    if days is None:
+        days = sort_days(day for tissue, day in blocks)
+    elif match_names:
+        days = match_group_names(days, sort_days(day for tissue, day in blocks), 'day')
+    tissue_index = {tissue: t for t, tissue in enumerate(tissues)}
+    day_index = {day: d for d, day in enumerate(days)}
+    blocks = {(tissue, day): values for (tissue, day), values in blocks.items()
+              if tissue in tissue_index and day in day_index}
+    with stage('medians', tissues=len(tissue_index), days=len(day_index), cytokines=len(cytokines),
+               groups=len(blocks)):
+        if cache is None:
+            group_medians = {key: get_block_medians(values) for key, values in blocks.items()}
+        else:
+            group_medians = get_cached_medians(blocks, cytokines, cache)
+        medians = numpy.full((len(tissue_index), len(day_index), len(cytokines)), numpy.nan)
+        for (tissue, day), values in group_medians.items():
+            medians[tissue_index[tissue], day_index[day]] = values
+    return MedianArray(list(tissues), list(days), [get_day_number(d) for d in days], list(cytokines), medians)
+
+
+"Function to get the median of every cytokine in every tissue at every time point straight from an input file"
+def read_median_array(path, cytokines=None, tissues=None, days=None, chunksize=100000, tissue_column='Tissue',
+                      day_column='Day', cache=None):
+    "path: path to the input file"
+    "cytokines: optional list of cytokines; by default every column except the tissue and the day"
+    "tissues, days: see get_median_array"
+    "chunksize: the number of rows read at a time; None reads the whole file at once"
+    "cache: optional ResultCache (see hypergraph_cache.py) reused for the median of each (tissue, day)"
+    "Returns a MedianArray"
+    "A median is not decomposable, so the float32 blocks of each (tissue, day) (see read_group_blocks) are kept"
+    "until the end of the file and reduced once"
+    if cytokines is None:
+        cytokines = get_input_cytokines(get_input_columns(path), tissue_column, day_column)
+    blocks = read_group_blocks(path, [tissue_column, day_column], cytokines, chunksize, tissue_column, day_column)
+    return get_median_array_from_blocks(blocks, cytokines, tissues, days, cache)
+
+
+"Function to write a data frame in one bulk write, as CSV, Parquet or Arrow IPC (Feather) by the file extension"
+def write_table(frame, path):
+    "frame: a pandas data frame"
+    "path: the file to write, see get_input_format"
+    output_format = get_input_format(path)
+    if output_format == 'csv':
+        frame.to_csv(path, index=False)
+    elif output_format == 'parquet':
+        frame.to_parquet(path, index=False)
+    else:
+        frame.reset_index(drop=True).to_feather(path)
+    return path
+
+
+"Function to write an Excel file row by row, so only the current row of each sheet is held in memory"
+def write_excel_rows(path, sheets):
+    "path: the Excel file to write"
+    "sheets: an iterable of (sheet name, iterable of rows), each row a list of cell values with None for empty"
+    "cells; the rows are consumed one at a time"
+    "Uses the constant_memory mode of xlsxwriter when it is installed and the write-only mode of openpyxl"
+    "otherwise"
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+    if xlsxwriter is not None:
+        with xlsxwriter.Workbook(path, {'constant_memory': True}) as workbook:
+            for name, rows in sheets:
+                worksheet = workbook.add_worksheet(name)
+                for r, row in enumerate(rows):
+                    for c, value in enumerate(row):
+                        if value is not None:
+                            worksheet.write(r, c, value)
+        return path
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, rows in sheets:
+        worksheet = workbook.create_sheet(name)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(path)
+    return path
+
+
+"Function to convert a CSV input into a Parquet file with the input dtypes, so later runs skip CSV parsing"
+def convert_csv_to_parquet(csv_path, parquet_path, chunksize=100000, tissue_column='Tissue', day_column='Day'):
+    "csv_path: path to the CSV input"
+    "parquet_path: path of the Parquet file to write"
+    "chunksize: the number of rows converted at a time"
+    import pyarrow
+    import pyarrow.parquet
+    writer = None
+    try:
+        for chunk in iter_input_chunks(csv_path, chunksize, None, tissue_column, day_column):
+            # categories differ between chunks, so the text columns are stored as plain strings
+            chunk = chunk.astype({tissue_column: str, day_column: str})
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(parquet_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return parquet_path
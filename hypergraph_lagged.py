@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy
+import pandas
+from hypergraph_engine import get_windows, bin_correlations, group_by_tissue_mask
+from hypergraph_io import write_table, write_excel_rows
+from hypergraph_profile import stage
+from dynamic_hypergraph import get_edge_levels, get_sheet_name
+
+# Lagged cross-tissue correlations. The dynamic hypergraphs correlate each cytokine with time inside one tissue;
+# to follow inflammation from one compartment to another, every cytokine of tissue A during window t is
+# correlated with every cytokine of tissue B during window t + lag, pairing the time points of the two windows
+# in order (with lag 0 both windows are the same and A and B differ).
+#
+# Each (tissue, window, cytokine) series of medians is centred and scaled to unit length once, so Pearson's r of
+# two series is their dot product, and all cytokine pairs of two tissues are one matrix product. A series with a
+# missing median or a constant one has no r. The products run one source window and one block of source
+# cytokines at a time, and only the r values reaching the smallest edge strength are kept, so the memory follows
+# the number of edges rather than windows x tissues^2 x cytokines^2.
+#
+# The edges are directed: a source cytokine in a source tissue points to a target cytokine, and the target
+# tissues in which the pair reaches the same edge strength form one directed hyperedge, ex: IL-6 in skin ->
+# TNF-a in muscle and plasma. With three time points per window about half of all pairs reach |r| >= 0.7, so a
+# group of tissues can hold tens of thousands of pairs: the Excel tables have one row per directed hyperedge
+# instead of spreading each group over columns like the dynamic hypergraphs.
+
+# rows of an Excel sheet, header included
+EXCEL_MAX_ROWS = 1048576
+
+
+"Function to centre and scale every window of median values, so Pearson's r of two series is a dot product"
+def get_standardized_windows(medians, window=3):
+    "medians: a MedianArray"
+    "window: the number of consecutive time points in each window"
+    "Returns an array of shape (tissues, windows, cytokines, window); NaN for a series with a missing value or"
+    "without any variation"
+    get_windows(medians.days, window)
+    values = numpy.asarray(medians.values, dtype=numpy.float64)
+    series = numpy.lib.stride_tricks.sliding_window_view(values, window, axis=1).copy()
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        series -= series.mean(axis=-1, keepdims=True)
+        series /= numpy.sqrt((series * series).sum(axis=-1, keepdims=True))
+    series[~numpy.isfinite(series).all(axis=-1)] = numpy.nan
+    return series
+
+
+"Function to get the lagged cross-tissue correlations that reach a threshold, as sparse arrays"
+def get_lagged_correlations(medians, window=3, lag=1, threshold=0.7, chunk_size=1024):
+    "medians: a MedianArray"
+    "window: the number of consecutive time points in each window"
+    "lag: the number of windows between the source and the target window, 0 or more"
+    "threshold: the smallest |r| kept; None keeps every r that is not NaN"
+    "chunk_size: the number of source cytokines multiplied at once; one product holds tissues^2 x chunk_size x"
+    "cytokines r values"
+    "Returns a dictionary of equally long arrays, one entry per kept r: 'window' (the source window), 'source"
+    "tissue', 'target tissue', 'source cytokine', 'target cytokine' (indices) and 'r'"
+    series = get_standardized_windows(medians, window)
+    n_tissues, n_windows, n_cytokines = series.shape[:3]
+    # the target tissues of a hyperedge are an int64 bitmask, like get_membership_masks
+    if n_tissues > 63:
+        raise ValueError("At most 63 tissues fit in a bitmask, got %d" % n_tissues)
+    if lag < 0 or lag >= n_windows:
+        raise ValueError("The lag must be between 0 and %d windows, got %d" % (n_windows - 1, lag))
+    # products over NaN series are NaN and dropped below, so NaN can be zeroed for the product
+    finite = numpy.nan_to_num(series)
+    missing = numpy.isnan(series[..., 0])
+    other = ~numpy.eye(n_tissues, dtype=bool)
+    parts = {name: [] for name in ('window', 'source tissue', 'target tissue', 'source cytokine',
+                                   'target cytokine', 'r')}
+    with stage('lagged correlations', tissues=n_tissues, windows=n_windows - lag, cytokines=n_cytokines,
+               lag=lag) as counts:
+        for n in range(n_windows - lag):
+            targets = finite[:, n + lag]
+            for start in range(0, n_cytokines, chunk_size):
+                sources = finite[:, n, start:start + chunk_size]
+                # r[a, b, i, j]: source tissue a, target tissue b, source cytokine start + i, target cytokine j
+                r = numpy.matmul(sources[:, None], targets[None].swapaxes(-1, -2))
+                keep = (~missing[:, n, start:start + chunk_size, None][:, None]
+                        & ~missing[:, n + lag][None, :, None, :] & other[:, :, None, None])
+                if threshold is not None:
+                    keep &= numpy.abs(r) >= threshold
+                a, b, i, j = numpy.nonzero(keep)
+                # compact indices: the kept edges can far outnumber the cytokines
+                parts['window'].append(numpy.full(len(a), n, dtype=numpy.int32))
+                parts['source tissue'].append(a.astype(numpy.int8))
+                parts['target tissue'].append(b.astype(numpy.int8))
+                parts['source cytokine'].append((i + start).astype(numpy.int32))
+                parts['target cytokine'].append(j.astype(numpy.int32))
+                # a dot product of unit vectors can leave [-1, 1] by rounding
+                parts['r'].append(numpy.clip(r[a, b, i, j], -1, 1))
+        results = {name: numpy.concatenate(values) for name, values in parts.items()}
+        counts['edges'] = len(results['r'])
+    return results
+
+
+class LaggedHypergraph:
+    "Directed cross-tissue hyperedges between each window and the window lag windows later"
+
+    def __init__(self, tissues, cytokines, windows, lag, levels, edges):
+        "tissues, cytokines, windows: see DynamicHypergraph"
+        "lag: the number of windows between the source and the target window"
+        "levels: the signed edge strengths, ex: [0.95, 0.7, -0.95, -0.7]"
+        "edges: the sparse correlations, see get_lagged_correlations"
+        self.tissues = list(tissues)
+        self.cytokines = list(cytokines)
+        self.windows = [list(w) for w in windows]
+        self.lag = lag
+        self.levels = list(levels)
+        self.edges = edges
+        self.binned = bin_correlations(edges['r'], [level for level in self.levels if level > 0])
+
+    @classmethod
+    def from_medians(cls, medians, window=3, lag=1, thresholds=(0.7, 0.95), chunk_size=1024):
+        "medians: a MedianArray"
+        "window, lag, chunk_size: see get_lagged_correlations"
+        "thresholds: the edge strengths, see bin_correlations"
+        edges = get_lagged_correlations(medians, window, lag, min(thresholds), chunk_size)
+        return cls(medians.tissues, medians.cytokines, get_windows(medians.days, window), lag,
+                   get_edge_levels(thresholds), edges)
+
+    def get_window_name(self, n):
+        "n: the index of a source window; returns the name of the window pair, ex: 'd0_d3_d5 to d3_d5_d7'"
+        return '%s to %s' % ('_'.join(self.windows[n]), '_'.join(self.windows[n + self.lag]))
+
+    def get_edges(self, n, level, include_empty=True):
+        "n: the index of a source window"
+        "level: one of self.levels, ex: -0.95"
+        "include_empty: see group_by_tissue_mask"
+        "Returns a dictionary from each source tissue and set of target tissues, ex: 'skin -> muscle and plasma',"
+        "to a list of cytokine pairs, ex: 'IL-6 -> TNF-a'"
+        return {'%s -> %s' % (source, targets): pairs
+                for source, targets, pairs in self._iter_groups(n, level, include_empty)}
+
+    def get_grouped_edge_rows(self, n):
+        "n: the index of a source window"
+        "Yields the rows of the Excel sheet of the window one at a time, as lists of cell values: a header row,"
+        "then one row per directed hyperedge with its source tissue, set of target tissues, signed edge strength"
+        "and cytokine pair, ex: ['skin', 'muscle and plasma', 0.95, 'IL-6 -> TNF-a']"
+        yield ['Source tissue', 'Target tissues', 'Edge', 'Cytokines']
+        for level in self.levels:
+            for source, targets, pairs in self._iter_groups(n, level, False):
+                for pair in pairs:
+                    yield [source, targets, level, pair]
+
+    def get_grouped_edges(self, n):
+        "n: the index of a source window"
+        "Returns a data frame with one row per directed hyperedge, see get_grouped_edge_rows. Unlike"
+        "DynamicHypergraph.get_grouped_edges the pairs are not spread over columns, since a group of tissues can"
+        "hold far more cytokine pairs than an Excel sheet has columns"
+        rows = self.get_grouped_edge_rows(n)
+        columns = next(rows)
+        return pandas.DataFrame(list(rows), columns=columns)
+
+    def get_hyperedge_counts(self):
+        "Returns the number of directed hyperedges of each source window, over every edge strength"
+        return [sum(len(self._get_hyperedges(n, level)[0]) for level in self.levels)
+                for n in range(len(self.windows) - self.lag)]
+
+    def to_excel(self, path):
+        "path: the Excel file to write; each pair of windows is saved to its own sheet, see get_grouped_edge_rows."
+        "The rows are written one at a time, see write_excel_rows"
+        "Raises ValueError when a sheet would pass the EXCEL_MAX_ROWS rows of Excel; to_edge_list has no limit"
+        counts = self.get_hyperedge_counts()
+        if counts and max(counts) >= EXCEL_MAX_ROWS:
+            n = int(numpy.argmax(counts))
+            raise ValueError("The windows %s have %d directed hyperedges, more than the %d rows of an Excel sheet;"
+                             " write the lagged edge list instead (to_edge_list, --lagged-edge-list)"
+                             % (self.get_window_name(n), counts[n], EXCEL_MAX_ROWS - 1))
+        with stage('lagged excel', sheets=len(counts), hyperedges=sum(counts)):
+            write_excel_rows(path, ((get_sheet_name(self.windows[n], self.windows[n + self.lag]),
+                                     self.get_grouped_edge_rows(n))
+                                    for n in range(len(counts))))
+        return path
+
+    def _get_hyperedges(self, n, level):
+        # one directed hyperedge per (source tissue, source cytokine, target cytokine): its key, sorted, and the
+        # bitmask of its target tissues
+        rows = numpy.flatnonzero((self.edges['window'] == n) & (self.binned == level))
+        n_cytokines = len(self.cytokines)
+        source_tissues = self.edges['source tissue'][rows].astype(numpy.int64)
+        keys = ((source_tissues * n_cytokines + self.edges['source cytokine'][rows]) * n_cytokines
+                + self.edges['target cytokine'][rows])
+        bits = numpy.left_shift(1, self.edges['target tissue'][rows].astype(numpy.int64))
+        order = numpy.argsort(keys, kind='stable')
+        keys, bits = keys[order], bits[order]
+        unique_keys, starts = numpy.unique(keys, return_index=True)
+        masks = numpy.bitwise_or.reduceat(bits, starts) if len(keys) else bits
+        return unique_keys, masks
+
+    def _iter_groups(self, n, level, include_empty):
+        # (source tissue, set of target tissues, cytokine pairs) of every group, source tissue by source tissue
+        unique_keys, masks = self._get_hyperedges(n, level)
+        n_cytokines = len(self.cytokines)
+        names = [t.lower() for t in self.tissues]
+        for s, source in enumerate(names):
+            cur = (unique_keys // (n_cytokines * n_cytokines)) == s
+            pairs = ['%s -> %s' % (self.cytokines[key // n_cytokines % n_cytokines],
+                                   self.cytokines[key % n_cytokines]) for key in unique_keys[cur]]
+            # drop the bit of the source tissue, which is never a target, so the sets are over the other tissues
+            low = (1 << s) - 1
+            cur_masks = (masks[cur] & low) | ((masks[cur] >> 1) & ~low)
+            groups = group_by_tissue_mask(pairs, cur_masks, names[:s] + names[s + 1:], include_empty)
+            for targets, cur_pairs in groups.items():
+                yield source, targets, cur_pairs
+
+    def get_edge_list(self):
+        "Returns a long data frame with one row per kept correlation at one of the edge strengths: Window,"
+        "Target window, Sign, Strength, Source tissue, Target tissue, Source cytokine, Target cytokine and r"
+        rows = numpy.flatnonzero(~numpy.isnan(self.binned))
+        names = ['_'.join(w) for w in self.windows]
+        windows = self.edges['window'][rows]
+        signed = self.binned[rows]
+        return pandas.DataFrame({
+            'Window': pandas.Categorical.from_codes(windows, names),
+            'Target window': pandas.Categorical.from_codes(windows + self.lag, names),
+            'Sign': pandas.Categorical.from_codes((signed < 0).astype(numpy.int8), ['positive', 'negative']),
+            'Strength': numpy.abs(signed),
+            'Source tissue': pandas.Categorical.from_codes(self.edges['source tissue'][rows], self.tissues),
+            'Target tissue': pandas.Categorical.from_codes(self.edges['target tissue'][rows], self.tissues),
+            'Source cytokine': pandas.Categorical.from_codes(self.edges['source cytokine'][rows], self.cytokines),
+            'Target cytokine': pandas.Categorical.from_codes(self.edges['target cytokine'][rows], self.cytokines),
+            'r': self.edges['r'][rows],
+        })
+
+    def to_edge_list(self, path):
+        "path: the file to write, CSV, Parquet or Arrow by its extension, see get_edge_list"
+        return write_table(self.get_edge_list(), path)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy
+import pandas
+from hypergraph_profile import stage
+
+# Quantitative metrics of dynamic hypergraphs, computed for every window at once from the tissue bitmasks of a
+# DynamicHypergraph (see dynamic_hypergraph.py). In these hypergraphs the tissues are the nodes and each
+# cytokine with an edge of a given strength is a hyperedge joining the tissues it appears in (the 'Cytokines'
+# column of DynamicHypergraph.get_edge_counts; its 'Tissue groups' are the rows of the grouped edge tables), so:
+#     hyperedge size: the number of tissues a cytokine joins (the number of bits of its mask)
+#     node degree: the number of cytokines with an edge in a tissue
+#     positive/negative ratio: positive over negative hyperedges in a window
+#     turnover: Jaccard overlap of the cytokines with an edge in two consecutive windows
+# The masks are unpacked into one flag per tissue once, and every metric is a sum or comparison over whole
+# arrays, so the cost does not depend on Python loops over cytokines or windows.
+
+METRICS = ['Hyperedge sizes', 'Node degrees', 'Sign ratios', 'Turnover']
+
+
+"Function to unpack the masks of a DynamicHypergraph into one flag per tissue"
+def get_tissue_flags(hypergraph):
+    "hypergraph: a DynamicHypergraph"
+    "Returns a boolean array of shape (windows, levels, cytokines, tissues)"
+    bits = numpy.arange(len(hypergraph.tissues), dtype=numpy.int64)
+    return (hypergraph.masks.astype(numpy.int64)[..., None] >> bits & 1).astype(bool)
+
+
+def _get_level_index(hypergraph):
+    # the Window and Edge columns shared by the metrics with one row per window and edge strength
+    n_windows, n_levels = hypergraph.masks.shape[:2]
+    return {
+        'Window': numpy.repeat([hypergraph.get_window_name(n) for n in range(n_windows)], n_levels),
+        'Edge': numpy.tile(hypergraph.levels, n_windows),
+    }
+
+
+"Function to count the hyperedges of each size in every window and edge strength"
+def get_hyperedge_sizes(hypergraph, flags=None):
+    "hypergraph: a DynamicHypergraph"
+    "flags: optional output of get_tissue_flags, to reuse it between metrics"
+    "Returns a data frame with one row per window and edge strength: the number of hyperedges joining 1, 2, ..."
+    "tissues ('Size 1', 'Size 2', ...) and their mean size"
+    if flags is None:
+        flags = get_tissue_flags(hypergraph)
+    n_tissues = flags.shape[-1]
+    sizes = flags.sum(axis=-1)
+    # counts[w, l, k - 1] is the number of cytokines joining k tissues
+    counts = (sizes[..., None] == numpy.arange(1, n_tissues + 1)).sum(axis=2)
+    counts = counts.reshape(-1, n_tissues)
+    n_edges = counts.sum(axis=1)
+    results = pandas.DataFrame(_get_level_index(hypergraph))
+    for k in range(n_tissues):
+        results['Size %d' % (k + 1)] = counts[:, k]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        results['Mean size'] = (counts * numpy.arange(1, n_tissues + 1)).sum(axis=1) / n_edges
+    return results
+
+
+"Function to get the degree of every tissue in every window and edge strength"
+def get_node_degrees(hypergraph, flags=None):
+    "hypergraph: a DynamicHypergraph"
+    "flags: optional output of get_tissue_flags"
+    "Returns a data frame with one row per window and edge strength and one column per tissue, with the number"
+    "of cytokines that have an edge in that tissue"
+    if flags is None:
+        flags = get_tissue_flags(hypergraph)
+    degrees = flags.sum(axis=2).reshape(-1, flags.shape[-1])
+    results = pandas.DataFrame(_get_level_index(hypergraph))
+    for t, tissue in enumerate(hypergraph.tissues):
+        results[tissue] = degrees[:, t]
+    return results
+
+
+"Function to compare the positive and negative hyperedges of every window"
+def get_sign_ratios(hypergraph):
+    "hypergraph: a DynamicHypergraph"
+    "Returns a data frame with one row per window: the number of positive and negative hyperedges (a cytokine"
+    "counts once per edge strength it has) and their ratio, inf when there are no negative hyperedges and NaN"
+    "when there are none at all"
+    positive = numpy.asarray(hypergraph.levels) > 0
+    present = hypergraph.masks != 0
+    n_positive = present[:, positive].sum(axis=(1, 2))
+    n_negative = present[:, ~positive].sum(axis=(1, 2))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        ratio = n_positive / n_negative
+    return pandas.DataFrame({
+        'Window': [hypergraph.get_window_name(n) for n in range(len(hypergraph.windows))],
+        'Positive hyperedges': n_positive,
+        'Negative hyperedges': n_negative,
+        'Positive/negative ratio': ratio,
+    })
+
+
+"Function to measure how the cytokines with an edge change from one window to the next"
+def get_turnover(hypergraph):
+    "hypergraph: a DynamicHypergraph"
+    "Returns a data frame with one row per pair of consecutive windows and sign ('positive', 'negative' and"
+    "'any'): the Jaccard overlap of the cytokines with an edge of that sign in both windows (NaN when neither"
+    "window has one), and how many cytokines were gained and lost"
+    positive = numpy.asarray(hypergraph.levels) > 0
+    present = hypergraph.masks != 0
+    # cytokine sets of shape (signs, windows, cytokines)
+    sets = numpy.stack([present[:, positive].any(axis=1), present[:, ~positive].any(axis=1), present.any(axis=1)])
+    before, after = sets[:, :-1], sets[:, 1:]
+    both = (before & after).sum(axis=-1)
+    either = (before | after).sum(axis=-1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        jaccard = both / either
+    names = [hypergraph.get_window_name(n) for n in range(len(hypergraph.windows))]
+    signs = ['positive', 'negative', 'any']
+    n_pairs = max(len(names) - 1, 0)
+    return pandas.DataFrame({
+        'Window': numpy.tile(names[:-1], len(signs)),
+        'Next window': numpy.tile(names[1:], len(signs)),
+        'Sign': numpy.repeat(signs, n_pairs),
+        'Jaccard': jaccard.reshape(-1),
+        'Gained': (after & ~before).sum(axis=-1).reshape(-1),
+        'Lost': (before & ~after).sum(axis=-1).reshape(-1),
+    })
+
+
+"Function to get every metric of a DynamicHypergraph"
+def get_hypergraph_metrics(hypergraph):
+    "hypergraph: a DynamicHypergraph"
+    "Returns a dictionary from each name in METRICS to its data frame"
+    with stage('metrics', windows=len(hypergraph.windows), cytokines=len(hypergraph.cytokines)):
+        flags = get_tissue_flags(hypergraph)
+        return {
+            'Hyperedge sizes': get_hyperedge_sizes(hypergraph, flags),
+            'Node degrees': get_node_degrees(hypergraph, flags),
+            'Sign ratios': get_sign_ratios(hypergraph),
+            'Turnover': get_turnover(hypergraph),
+        }
+
+
+"Function to get the metrics of many subjects as one data frame per metric"
+def get_subject_metrics(hypergraphs):
+    "hypergraphs: a dictionary from each subject to its DynamicHypergraph"
+    "Returns a dictionary from each name in METRICS to a data frame of every subject, with a Subject column"
+    frames = {name: [] for name in METRICS}
+    for subject, hypergraph in hypergraphs.items():
+        for name, frame in get_hypergraph_metrics(hypergraph).items():
+            frame.insert(0, 'Subject', subject)
+            frames[name].append(frame)
+    return {name: pandas.concat(cur_frames, ignore_index=True) if cur_frames else pandas.DataFrame()
+            for name, cur_frames in frames.items()}
+
+
+"Function to save the metrics to one csv file per metric"
+def write_metrics(metrics, path_pattern):
+    "metrics: a dictionary from metric name to data frame, see get_hypergraph_metrics"
+    "path_pattern: the file name of each metric, '%s' is replaced by the metric name with '_' for spaces, ex:"
+    "'Dynamic_Hypergraphs_%s.csv'"
+    "Returns the list of saved files"
+    paths = []
+    for name, frame in metrics.items():
+        paths.append(path_pattern % name.replace(' ', '_'))
+        frame.to_csv(paths[-1], index=False)
+    return paths
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import itertools
+import math
+import os
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from hypergraph_engine import get_pearson_r, get_windows, get_window_correlations, get_membership_masks
+from dynamic_hypergraph import DynamicHypergraph
+from hypergraph_profile import stage
+
+# Permutation tests of the window correlations. With three time points per window |r| >= 0.7 happens easily by
+# chance, so each r is compared against its null distribution: the r values obtained after shuffling either
+#     'time': the time points of the window (the medians stay, their order in time is shuffled), or
+#     'samples': the raw samples of a tissue between the days of the window, recomputing the daily medians.
+# The p-value of an r is the share of permutations reaching its |r| (two-sided). Every permutation of a chunk
+# is computed at once as a NumPy batch for all tissues and cytokines, chunks bound the memory, and the chunks
+# can run in a process pool. The permutations come from one seeded generator per test and are drawn in the
+# same order whatever the chunk size or the number of workers, so a seed always gives the same p-values.
+# When a window has no more orderings than permutations requested (ex: 3! = 6 for three time points), the
+# 'time' test enumerates them all and its p-values are exact.
+
+PERMUTATION_MODES = ('time', 'samples')
+# |r| of a permutation within this distance of the observed |r| counts as reaching it (rounding of equal r)
+TOLERANCE = 1e-12
+
+
+"Function to get the p-values of the window correlations by shuffling the time points of each window"
+def get_time_permutation_pvalues(medians, window=3, n_permutations=1000, seed=0, chunk_size=100, workers=1):
+    "medians: a MedianArray"
+    "window: the number of consecutive time points in each window"
+    "n_permutations: the number of random permutations; when the window has at most this many orderings, every"
+    "ordering is used once instead"
+    "seed: seed of the random number generator"
+    "chunk_size: the number of permutations computed at once; a chunk holds chunk_size x tissues x windows x"
+    "cytokines r values"
+    "workers: the number of processes; None uses every core and 1 computes in this process"
+    "Returns an array of p-values of shape (tissues, windows, cytokines), NaN where r is NaN"
+    get_windows(medians.days, window)
+    r = get_window_correlations(medians, window)
+    values = numpy.lib.stride_tricks.sliding_window_view(numpy.asarray(medians.values, dtype=numpy.float64),
+                                                         window, axis=1)
+    times = numpy.lib.stride_tricks.sliding_window_view(numpy.asarray(medians.times, dtype=numpy.float64),
+                                                        window)
+    values = numpy.ascontiguousarray(values)
+    times = numpy.ascontiguousarray(times)
+    exact = math.factorial(window) <= n_permutations
+    if exact:
+        orders = numpy.array(list(itertools.permutations(range(window))))
+        chunks = (orders[n:n + chunk_size] for n in range(0, len(orders), chunk_size))
+        total = len(orders)
+    else:
+        chunks = _iter_random_orders(numpy.random.default_rng(seed), n_permutations, window, chunk_size)
+        total = n_permutations
+    with stage('permutations', mode='time', permutations=total, exact=exact, tissues=len(medians.tissues),
+               windows=len(times), cytokines=len(medians.cytokines)):
+        tasks = ((values, times, numpy.abs(r), order) for order in chunks)
+        counts = sum(map_bounded(_count_time_exceedances, tasks, workers))
+        return _get_pvalues(counts, total, r, exact)
+
+
+"Function to get the p-values of the window correlations by shuffling the raw samples between the days of each"
+"window, within each tissue"
+def get_sample_permutation_pvalues(blocks, medians, window=3, n_permutations=1000, seed=0, chunk_size=100,
+                                   workers=1):
+    "blocks: a dictionary from (tissue, day) to an array of raw values of shape (samples, cytokines), see"
+    "hypergraph_io.read_group_blocks; medians is expected to be the MedianArray of these blocks"
+    "medians: a MedianArray"
+    "window, n_permutations, seed, workers: see get_time_permutation_pvalues"
+    "chunk_size: the number of permutations computed at once; a chunk holds chunk_size x samples x cytokines"
+    "values of one tissue and window"
+    "Returns an array of p-values of shape (tissues, windows, cytokines), NaN where r is NaN"
+    windows = get_windows(medians.days, window)
+    r = get_window_correlations(medians, window)
+    n_cytokines = len(medians.cytokines)
+    # one generator per (tissue, window), so each test draws the same permutations however it is split
+    generators = numpy.random.SeedSequence(seed).spawn(len(medians.tissues) * len(windows))
+
+    def iter_tasks():
+        for t, tissue in enumerate(medians.tissues):
+            for n, days in enumerate(windows):
+                parts = [numpy.asarray(blocks.get((tissue, day), numpy.empty((0, n_cytokines))),
+                                       dtype=numpy.float64) for day in days]
+                pooled = numpy.concatenate(parts)
+                sizes = [len(part) for part in parts]
+                times = numpy.asarray(medians.times[n:n + window], dtype=numpy.float64)
+                rng = numpy.random.default_rng(generators[t * len(windows) + n])
+                for order in _iter_random_orders(rng, n_permutations, len(pooled), chunk_size):
+                    yield t, n, pooled, sizes, times, numpy.abs(r[t, n]), order
+
+    counts = numpy.zeros(r.shape, dtype=numpy.int64)
+    with stage('permutations', mode='samples', permutations=n_permutations, tissues=len(medians.tissues),
+               windows=len(windows), cytokines=n_cytokines):
+        for t, n, count in map_bounded(_count_sample_task, iter_tasks(), workers):
+            counts[t, n] += count
+    return _get_pvalues(counts, n_permutations, r, False)
+
+
+"Function to adjust p-values for multiple testing with the Benjamini-Hochberg false discovery rate"
+def get_fdr(p):
+    "p: an array of p-values of any shape; NaN values are not tests and stay NaN"
+    "Returns the q-values, shaped like p"
+    p = numpy.asarray(p, dtype=numpy.float64)
+    q = numpy.full(p.shape, numpy.nan)
+    tested = ~numpy.isnan(p)
+    values = p[tested]
+    order = numpy.argsort(values)
+    ranked = values[order] * len(values) / numpy.arange(1, len(values) + 1)
+    # the q-value of a p-value is the smallest adjusted value at its rank or above
+    ranked = numpy.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = numpy.empty(len(values))
+    adjusted[order] = numpy.minimum(ranked, 1)
+    q[tested] = adjusted
+    return q
+
+
+"Function to store p-values and their false discovery rates on a DynamicHypergraph"
+def attach_pvalues(hypergraph, p):
+    "hypergraph: a DynamicHypergraph"
+    "p: an array of p-values of shape (tissues, windows, cytokines), like hypergraph.r"
+    "The q-values are computed over every test, see get_fdr; both then appear in hypergraph.get_edge_list"
+    hypergraph.p = numpy.asarray(p, dtype=numpy.float64)
+    hypergraph.q = get_fdr(hypergraph.p)
+    return hypergraph
+
+
+"Function to keep only the significant hyperedges of a DynamicHypergraph"
+def get_significant_hypergraph(hypergraph, alpha=0.05, use_fdr=True):
+    "hypergraph: a DynamicHypergraph with p-values, see attach_pvalues"
+    "alpha: the significance level"
+    "use_fdr: when True the q-values are compared with alpha, otherwise the p-values"
+    "Returns a new DynamicHypergraph where a cytokine only keeps the tissues in which its r is significant; the"
+    "bootstrap stability, if any, is kept as is and so refers to the hyperedges before the filter"
+    values = hypergraph.q if use_fdr else hypergraph.p
+    if values is None:
+        raise ValueError("This DynamicHypergraph has no p-values, see attach_pvalues")
+    significant = get_membership_masks(values <= alpha).astype(hypergraph.masks.dtype)
+    results = DynamicHypergraph(hypergraph.tissues, hypergraph.cytokines, hypergraph.windows, hypergraph.levels,
+                                hypergraph.masks & significant[:, None, :], hypergraph.r)
+    results.p = hypergraph.p
+    results.q = hypergraph.q
+    results.stability = hypergraph.stability
+    return results
+
+
+def _iter_random_orders(rng, n_permutations, n, chunk_size):
+    if n_permutations < 1:
+        raise ValueError("At least one permutation is needed, got %d" % n_permutations)
+    # random permutations of range(n) as the argsort of uniform keys; the keys are drawn row by row, so the
+    # permutations do not depend on the chunk size
+    for start in range(0, n_permutations, chunk_size):
+        yield numpy.argsort(rng.random((min(chunk_size, n_permutations - start), n)), axis=1)
+
+
+def _count_time_exceedances(values, times, abs_r, order):
+    # values: (tissues, windows, cytokines, window); times: (windows, window); order: (permutations, window)
+    x = times[:, order].transpose(1, 0, 2)
+    r = get_pearson_r(x[:, None, :, None, :], values[None])
+    return (numpy.abs(r) >= abs_r - TOLERANCE).sum(axis=0)
+
+
+def _count_sample_task(t, n, *arguments):
+    return t, n, _count_sample_exceedances(*arguments)
+
+
+def _count_sample_exceedances(pooled, sizes, times, abs_r, order):
+    # pooled: (samples, cytokines) of every day of the window; order: (permutations, samples)
+    shuffled = pooled[order]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        medians = numpy.stack([numpy.nanmedian(part, axis=1) if part.shape[1] else
+                               numpy.full((len(order), pooled.shape[1]), numpy.nan)
+                               for part in numpy.split(shuffled, numpy.cumsum(sizes)[:-1], axis=1)], axis=-1)
+    r = get_pearson_r(times, medians)
+    return (numpy.abs(r) >= abs_r - TOLERANCE).sum(axis=0)
+
+
+def _get_pvalues(counts, total, r, exact):
+    # exact tests enumerate the observed ordering too; random ones add it, so p is never 0
+    p = counts / total if exact else (counts + 1) / (total + 1)
+    return numpy.where(numpy.isnan(r), numpy.nan, p)
+
+
+"Function to run a function on many tasks in a process pool, like ProcessPoolExecutor.map, but with at most two"
+"tasks per worker submitted at a time, so the tasks are made only as they are needed"
+def map_bounded(function, tasks, workers, initializer=None, initargs=()):
+    "function: a module-level function"
+    "tasks: an iterable of argument tuples"
+    "workers: the number of processes; None uses every core and 1 runs in this process"
+    "initializer, initargs: optional function run once in each process, ex: to hand over large shared inputs"
+    "Yields the results in the order of the tasks"
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield function(*task)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(function, *task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+# Instrumentation of the pipeline stages. The pipeline marks its stages with
+#     with stage('correlations', windows=9) as counts:
+#         ...
+#         counts['cytokines'] = 120
+# which does nothing unless a RunReport is active. While a report is active, each stage records its wall time,
+# CPU time (of this process and of finished worker processes), memory and its item counts (rows, cytokines,
+# windows, hyperedges, ...), and can be profiled with cProfile. The memory is the RSS of this process at the start
+# and end of the stage, how much the stage raised its peak RSS, the peak RSS of the process so far and the largest
+# peak RSS of any finished worker process (ex: of the process pools drawing images or testing permutations).
+# The peaks never go down, so a stage that raised neither peak stayed below the earlier stages. The report is
+# written as JSON so runs can be tracked and compared.
+#
+# Stages: 'read' (parsing the input into blocks), 'medians', 'correlations', 'grouping' (hyperedge masks),
+# 'metrics', 'permutations', 'bootstrap', 'lagged correlations', 'excel', 'lagged excel', 'edge list', 'images'
+# and 'batch'. Stages that run inside worker processes (ex: each subject of a batch) are not recorded one by one;
+# their CPU time shows up as child_cpu_seconds and their memory as child_peak_rss_bytes of the stage that waited
+# for them.
+
+_active_report = contextvars.ContextVar('hypergraph_run_report', default=None)
+
+
+"Function to get the peak resident memory of this process so far, in bytes; None where it is not available"
+def get_peak_rss(children=False):
+    "children: when True, the largest peak of any finished child process instead, ex: the workers of a pool"
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+"Function to get the current resident memory of this process, in bytes; None where it is not available"
+def get_current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _get_children_cpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class RunReport:
+    "Measurements of every pipeline stage of one run"
+
+    def __init__(self, profile_directory=None, **info):
+        "profile_directory: optional folder for one cProfile file (.prof) per stage"
+        "info: anything else to store in the report, ex: input='A3_A4_Input.csv'"
+        self.profile_directory = profile_directory
+        self.info = info
+        self.stages = []
+        self.started = time.time()
+        self._token = None
+        self._start_wall = None
+        self._start_cpu = None
+        self._start_children_cpu = None
+        self._end = None
+        self._profiling = False
+
+    def start(self):
+        "Makes this the active report: from now on every stage of the pipeline is recorded here"
+        self._token = _active_report.set(self)
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._start_children_cpu = _get_children_cpu()
+        self._end = None
+        return self
+
+    def stop(self):
+        "Stops recording stages"
+        if self._token is not None:
+            _active_report.reset(self._token)
+            self._token = None
+        self._end = (time.perf_counter(), time.process_time(), _get_children_cpu())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        "name: the name of the stage, ex: 'correlations'"
+        "counts: item counts known up front; more can be added to the yielded dictionary"
+        counts = dict(counts)
+        # only one profiler can run at a time, so nested stages are part of the outer profile
+        profiler = None
+        if self.profile_directory is not None and not self._profiling:
+            profiler = cProfile.Profile()
+            self._profiling = True
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_children_cpu = _get_children_cpu()
+        start_rss = get_current_rss()
+        start_peak = get_peak_rss()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield counts
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            peak = get_peak_rss()
+            record = {
+                'stage': name,
+                'wall_seconds': time.perf_counter() - start_wall,
+                'cpu_seconds': time.process_time() - start_cpu,
+                'child_cpu_seconds': _get_children_cpu() - start_children_cpu,
+                'start_rss_bytes': start_rss,
+                'end_rss_bytes': get_current_rss(),
+                'peak_rss_increase_bytes': None if peak is None else peak - start_peak,
+                'peak_rss_bytes': peak,
+                'child_peak_rss_bytes': get_peak_rss(children=True),
+                'counts': counts,
+            }
+            if profiler is not None:
+                os.makedirs(self.profile_directory, exist_ok=True)
+                path = os.path.join(self.profile_directory,
+                                    '%03d_%s.prof' % (len(self.stages) + 1, re.sub(r'\W+', '_', name)))
+                profiler.dump_stats(path)
+                record['profile'] = path
+            self.stages.append(record)
+
+    def get_stage_totals(self):
+        "Returns the wall and CPU time of each stage name summed over all its runs, ex: one 'excel' per subject"
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record['stage'], {'runs': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                        'child_cpu_seconds': 0.0})
+            total['runs'] += 1
+            for key in ('wall_seconds', 'cpu_seconds', 'child_cpu_seconds'):
+                total[key] += record[key]
+        return totals
+
+    def to_dict(self):
+        "Returns the report as a dictionary of JSON types"
+        end = self._end or (time.perf_counter(), time.process_time(), _get_children_cpu())
+        results = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'argv': list(sys.argv),
+            'info': self.info,
+            'stages': self.stages,
+            'stage_totals': self.get_stage_totals(),
+            'peak_rss_bytes': get_peak_rss(),
+            'child_peak_rss_bytes': get_peak_rss(children=True),
+        }
+        if self._start_wall is not None:
+            results['wall_seconds'] = end[0] - self._start_wall
+            results['cpu_seconds'] = end[1] - self._start_cpu
+            results['child_cpu_seconds'] = end[2] - self._start_children_cpu
+        return results
+
+    def write_json(self, path):
+        "path: the JSON file to write"
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=_to_json)
+        return path
+
+
+def _to_json(value):
+    # NumPy numbers in the counts
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+"Function to record a pipeline stage in the active RunReport; does nothing when no report is active"
+@contextlib.contextmanager
+def stage(name, **counts):
+    "name, counts: see RunReport.stage"
+    report = _active_report.get()
+    if report is None:
+        yield dict(counts)
+        return
+    with report.stage(name, **counts) as cur_counts:
+        yield cur_counts
+
+
+"Function to get the active RunReport, or None"
+def get_active_report():
+    return _active_report.get()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from hypergraph_cache import get_figure_key
+from hypergraph_profile import stage
+
+# Drawing of the dynamic hypergraph images. Everything here uses the object-oriented matplotlib API on Agg
+# canvases, so no pyplot figure is ever registered: nothing needs a display, figures are freed as soon as they
+# are saved and the windows of a run can be drawn in separate processes.
+
+# The tissues drawn, from top to bottom; plot_hypergraph looks up the groups by these names in this order
+IMAGE_TISSUES = ['Muscle', 'Skin', 'Plasma']
+
+
+#Function to plot a singular dynamic hypergraph
+def plot_hypergraph(cur_dict, color, figure, grid_spec, panel, title, thickness):
+    "cur_dict: a dictionary where the keys are nodes or groups of nodes and the definitions are edges"
+    "ex: edge_neg_095_sorted"
+    "color: the color of the graph"
+    "figure: the actual figure panel, a pyplot figure or a matplotlib.figure.Figure"
+    "grid_spec: to space the graphs"
+    "panel: A, B, C, or D, to specify the location of the subplot on the overall figure"
+    "title: title of the subgraph"
+    "thickness: an integer, indicating the thickness of the lines of the graph"
+    
+    if panel == 'A':
+        ax = figure.add_subplot(grid_spec[0,0])
+    elif panel == 'B':
+        ax = figure.add_subplot(grid_spec[0,1])
+    elif panel == 'C':
+        ax = figure.add_subplot(grid_spec[1,0])
+    else:
+        ax = figure.add_subplot(grid_spec[1,1])
+        
+    ax.set_title(title, size=36)
+    x_coords_edge = [0.75,6]
+    # coordinates for the location of groups of edges depending on the edge group (ex: muscle and plasma located
+    # at (10, 8.34))
+    muscle_only_y = [10, 10]
+    skin_only_y =[5, 5]
+    plasma_only_y = [0.1, 0.1]
+    muscle_skin_y1 = [10, 6.67]
+    muscle_skin_y2 = [5, 6.67]
+    muscle_plasma_y1 = [10, 8.34]
+    muscle_plasma_y2 = [0.1, 8.34]
+    plasma_skin_y1 = [0.1, 3.34]
+    plasma_skin_y2 = [5, 3.34]
+    msp_y1 = [10, 1.67]
+    msp_y2 = [5, 1.67]
+    msp_y3 = [0.1, 1.67]
+    
+    muscle_label = 'MUSCLE'
+    skin_label = 'SKIN'
+    plasma_label = 'PLASMA'
+    ax.text(-2,10.2, muscle_label, fontsize=36, verticalalignment='top')
+    ax.text(-2,5.2, skin_label, fontsize=36, verticalalignment='top')
+    ax.text(-2,0.2, plasma_label, fontsize=36,verticalalignment='top')
+    if (cur_dict['muscle']) != []:
+        ax.plot(x_coords_edge, muscle_only_y, color, linewidth = thickness)
+        if len(cur_dict['muscle']) > 5:
+            ax.text(6.5, 10.3, "           ".join(cur_dict['muscle'][0:6]),fontsize=24, verticalalignment='top')
+            ax.text(6.5, 10, "           ".join(cur_dict['muscle'][6:]),fontsize=24, verticalalignment='top')
+        else:
+            ax.text(6.5, 10.2, "           ".join(cur_dict['muscle']),fontsize=24, verticalalignment='top')
+    if (cur_dict['skin']) != []:
+        ax.plot(x_coords_edge, skin_only_y, color, linewidth = thickness)
+        if len(cur_dict['skin']) > 5:
+            ax.text(6.5, 5.3, "           ".join(cur_dict['skin'][0:6]),fontsize=24, verticalalignment='top')
+            ax.text(6.5, 4.6, "           ".join(cur_dict['skin'][6:]),fontsize=24, verticalalignment='top')
+        else:
+            ax.text(6.5, 5.2, "           ".join(cur_dict['skin']),fontsize=24, verticalalignment='top')
+    if (cur_dict['plasma']) != []:
+        ax.plot(x_coords_edge, plasma_only_y, color, linewidth = thickness)
+        if len(cur_dict['plasma']) > 5:
+            ax.text(6.5, 0.7, "           ".join(cur_dict['plasma'][0:6]),fontsize=24, verticalalignment='top')
+            ax.text(6.5, 0.1, "           ".join(cur_dict['plasma'][6:]),fontsize=24, verticalalignment='top')
+        else:
+            ax.text(6.5, 0.2, "           ".join(cur_dict['plasma']),fontsize= 24, verticalalignment='top')
+    if (cur_dict['muscle and skin']) != []:
+        ax.plot(x_coords_edge, muscle_skin_y1, color, linewidth = thickness)
+        ax.plot(x_coords_edge, muscle_skin_y2, color, linewidth = thickness)
+        if len(cur_dict['muscle and skin']) > 5:
+            ax.text(6.5, 6.97, "           ".join(cur_dict['muscle and skin'][0:6]),fontsize=24, verticalalignment='top')
+            ax.text(6.5, 6.67, "           ".join(cur_dict['muscle and skin'][6:]),fontsize=24, verticalalignment='top')
+        else:
+            ax.text(6.5, 6.87, "           ".join(cur_dict['muscle and skin']),fontsize=24, verticalalignment='top')
+    if (cur_dict['muscle and plasma']) != []:
+        ax.plot(x_coords_edge, muscle_plasma_y1, color, linewidth = thickness)
+        ax.plot(x_coords_edge, muscle_plasma_y2, color, linewidth = thickness)
+        if len(cur_dict['muscle and plasma']) > 5:
+            ax.text(6.5, 8.64, "           ".join(cur_dict['muscle and plasma'][0:6]),fontsize=24, verticalalignment='top')
+            ax.text(6.5, 8.34, "           ".join(cur_dict['muscle and plasma'][6:]),fontsize=24, verticalalignment='top')
+        else: 
+            ax.text(6.5, 8.54, "           ".join(cur_dict['muscle and plasma']),fontsize=24, verticalalignment='top')
+    if (cur_dict['skin and plasma']) != []:
+        ax.plot(x_coords_edge, plasma_skin_y1, color, linewidth = thickness)
+        ax.plot(x_coords_edge, plasma_skin_y2, color, linewidth = thickness)
+        if len(cur_dict['skin and plasma']) > 5:
+            ax.text(6.5, 3.64, "           ".join(cur_dict['skin and plasma'][0:6]),fontsize=24, verticalalignment='top')
+            ax.text(6.5, 2.90, "           ".join(cur_dict['skin and plasma'][6:]),fontsize=24, verticalalignment='top')
+        else:
+            ax.text(6.5, 3.54, "           ".join(cur_dict['skin and plasma']),fontsize=24, verticalalignment='top')
+    if (cur_dict['muscle, skin, and plasma']) != []:
+        ax.plot(x_coords_edge, msp_y1, color, linewidth = thickness)
+        ax.plot(x_coords_edge, msp_y2, color, linewidth = thickness)
+        ax.plot(x_coords_edge, msp_y3, color, linewidth = thickness)
+        if len(cur_dict['muscle, skin, and plasma']) > 5:
+            ax.text(6.5, 1.97, "           ".join(cur_dict['muscle, skin, and plasma'][0:6]),fontsize=24, verticalalignment='top')
+            ax.text(6.5, 1.67, "           ".join(cur_dict['muscle, skin, and plasma'][6:]),fontsize=24, verticalalignment='top')
+        else:
+            ax.text(6.5, 1.77, "           ".join(cur_dict['muscle, skin, and plasma']),fontsize=24, verticalalignment='top')
+        
+
+    ax.set_xlim(0,10)
+    ax.set_ylim(-1,12)
+    ax.axis('off')
+    return figure
+
+
+# Function to draw and save the image of one time interval
+def render_hypergraph_figure(positive_edges, negative_edges, strength, title, path):
+    "positive_edges: a dictionary of the edges with r >= +strength, as made by DynamicHypergraph.get_edges"
+    "negative_edges: a dictionary of the edges with r <= -strength"
+    "strength: the edge strength drawn, ex: 0.95"
+    "title: title for dynamic hypergraph image"
+    "path: the file the image is saved to"
+    fig = Figure(figsize=(18, 18))
+    FigureCanvasAgg(fig)
+    gs = fig.add_gridspec(nrows=2, ncols=1, hspace= 0.5, wspace=1.5)
+    plot_hypergraph(positive_edges, 'k-', fig, gs, 'A', "Pearson's r > +%g"%strength, 8)
+#     plot_hypergraph(edge_pos_07_sorted, 'k-', fig, gs, 'B', "Pearson's r > +0.7", 2)
+    plot_hypergraph(negative_edges, 'r-', fig, gs, 'C', "Pearson's r < - %g"%strength, 8)
+#     plot_hypergraph(edge_neg_07_sorted, 'r-', fig, gs, 'D', "Pearson's r < -0.7", 2)
+    fig.suptitle(title, size=40)
+    fig.savefig(path, bbox_inches="tight")
+    # release the artists right away instead of waiting for the garbage collector
+    fig.clear()
+    return path
+
+
+# Function to draw the images of every time interval of a DynamicHypergraph, optionally in a process pool
+def render_dynamic_hypergraphs(hypergraph, path_pattern='A3A4_%s.png', workers=None, cache=None):
+    "hypergraph: a DynamicHypergraph"
+    "path_pattern: the file name of each image, '%s' is replaced by the time points, ex: 'd0, d3, d5'"
+    "workers: the number of processes drawing images; None uses every core and 1 draws in this process"
+    "cache: optional ResultCache; an image whose hyperedges are cached is copied from the cache instead of"
+    "being drawn again"
+    "Returns the list of saved files"
+    with stage('images', windows=len(hypergraph.windows)) as counts:
+        hypergraph = get_image_hypergraph(hypergraph)
+        strength = hypergraph.levels[0]
+        tasks = []
+        for n in range(len(hypergraph.windows)):
+            title = ', '.join(hypergraph.windows[n])
+            # only the small edge dictionaries are sent to the workers, never the incidence array
+            tasks.append((hypergraph.get_edges(n, strength), hypergraph.get_edges(n, -strength), strength, title,
+                          path_pattern % title))
+        paths = [task[-1] for task in tasks]
+        if cache is not None:
+            keys = [get_figure_key(*task[:-1]) for task in tasks]
+            missing = []
+            for task, key in zip(tasks, keys):
+                image = cache.get(key)
+                if image is None:
+                    missing.append(task)
+                else:
+                    _write_bytes(task[-1], image)
+            tasks = missing
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(tasks))
+        if workers <= 1:
+            for task in tasks:
+                render_hypergraph_figure(*task)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(render_hypergraph_figure, *zip(*tasks)))
+        if cache is not None:
+            for task in tasks:
+                with open(task[-1], 'rb') as f:
+                    cache.put(get_figure_key(*task[:-1]), f.read())
+        counts['drawn'] = len(tasks)
+    return paths
+
+
+# Function to put the tissues of a DynamicHypergraph in the order of the images, whatever the order of the input
+def get_image_hypergraph(hypergraph):
+    "hypergraph: a DynamicHypergraph with muscle, skin and plasma among its tissues (in any case and order)"
+    "Returns a DynamicHypergraph with the tissues of IMAGE_TISSUES first, in that order, then any other tissue"
+    names = [t.lower() for t in hypergraph.tissues]
+    missing = [t for t in IMAGE_TISSUES if t.lower() not in names]
+    if missing:
+        raise ValueError("The images need the tissues %s, missing: %s" % (IMAGE_TISSUES, missing))
+    first = [hypergraph.tissues[names.index(t.lower())] for t in IMAGE_TISSUES]
+    order = first + [t for t in hypergraph.tissues if t not in first]
+    if order == hypergraph.tissues:
+        return hypergraph
+    return hypergraph.get_reordered(order)
+
+
+def _write_bytes(path, data):
+    # leave an identical file untouched so its timestamp does not change
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return
+    with open(path, 'wb') as f:
+        f.write(data)